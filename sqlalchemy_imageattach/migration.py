@@ -2,6 +2,9 @@
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 """
+import itertools
+import multiprocessing.pool
+
 from sqlalchemy.ext.declarative.api import DeclarativeMeta
 from sqlalchemy.orm.session import Session
 
@@ -62,12 +65,11 @@ def migrate(session, declarative_base, source, destination):
     )
 
     # FIXME: it's not aware of single table inheritance
-    @MigrationPlan
-    def result():
+    def images():
         for cls in classes:
-            for instance in migrate_class(session, cls, source, destination):
+            for instance in session.query(cls):
                 yield instance
-    return result
+    return MigrationPlan(images, _make_migrate_image(source, destination))
 
 
 def migrate_class(session, cls, source, destination):
@@ -113,42 +115,107 @@ def migrate_class(session, cls, source, destination):
                         'sqlalchemy_imageattach.store.Store, not ' +
                         repr(source))
 
-    @MigrationPlan
-    def result():
-        for instance in session.query(cls):
-            with source.open(instance) as f:
-                destination.store(instance, f)
-                yield instance
-    return result
+    return MigrationPlan(lambda: session.query(cls),
+                         _make_migrate_image(source, destination))
+
+
+def _make_migrate_image(source, destination):
+    def migrate_image(instance):
+        with source.open(instance) as f:
+            destination.store(instance, f)
+        return instance
+    return migrate_image
+
+
+# The attributes of Image that Store.open() and Store.store() read to
+# locate the image file.
+_STORE_KEY_ATTRIBUTES = ('object_type', 'object_id', 'width', 'height',
+                         'mimetype', 'original')
+
+
+def _load_store_key(instance):
+    # Expired or deferred attributes are loaded through the session when
+    # they are read, so it has to be done in the thread owning it.
+    for attr in _STORE_KEY_ATTRIBUTES:
+        getattr(instance, attr)
+    return instance
 
 
 class MigrationPlan(object):
-    """Iterable object that yields migrated images."""
+    """Iterable object that yields migrated images.
+
+    :param function: the function that returns an iterable of images.
+                     if ``migrate_image`` is omitted, the images have to
+                     be already migrated when they are yielded
+    :type function: :class:`~typing.Callable`\ [[],
+        :class:`~typing.Iterable`\ [:class:`~.entity.Image`]]
+    :param migrate_image: an optional function that migrates the given
+                          image and then returns it
+    :type migrate_image: :class:`~typing.Callable`\ [
+        [:class:`~.entity.Image`], :class:`~.entity.Image`]
 
-    def __init__(self, function):
+    .. versionadded:: 1.2.0
+       The ``migrate_image`` parameter.
+
+    """
+
+    def __init__(self, function, migrate_image=None):
         self.function = function
+        self.migrate_image = migrate_image
 
     def __iter__(self):
-        return self.function()
+        if self.migrate_image is None:
+            return iter(self.function())
+        return (self.migrate_image(i) for i in self.function())
 
-    def execute(self, callback=None):
+    def execute(self, callback=None, workers=1):
         """Execute the plan.  If optional ``callback`` is present,
         it is invoked with an :class:`~sqlalchemy_imageattach.entity.Image`
         instance for every migrated image.
 
+        Since migration is mostly bound to I/O, images can be copied
+        concurrently by ``workers`` threads.  Images are still queried
+        and ``callback`` is still invoked in the calling thread.
+        The attributes that stores read to locate image files are loaded
+        in the calling thread as well, so that worker threads don't have
+        to query through the session.
+
         :param callback: an optional callback that takes
                          an :class:`~sqlalchemy_imageattach.entity.Image`
                          instance.  it's called zero or more times
         :type callback: :class:`~typing.Callable`\ [[:class:`~.entity.Image`],
                                                      :const:`None`]
+        :param workers: the number of images to copy concurrently.
+                        1 (no concurrency) by default
+        :type workers: :class:`numbers.Integral`
+
+        .. versionadded:: 1.2.0
+           The ``workers`` parameter.
 
         """
-        if callback is None:
-            for _ in self:
-                pass
-        elif not callable(callback):
+        if callback is not None and not callable(callback):
             raise TypeError('callback must be callable, not ' +
                             repr(callback))
-        else:
+        if workers < 2 or self.migrate_image is None:
             for instance in self:
-                callback(instance)
+                if callback is not None:
+                    callback(instance)
+            return
+        pool = multiprocessing.pool.ThreadPool(workers)
+        try:
+            images = iter(self.function())
+            while 1:
+                # Only a few images are read ahead at a time, so that
+                # the query result doesn't have to be loaded at once.
+                batch = [
+                    _load_store_key(instance)
+                    for instance in itertools.islice(images, workers * 2)
+                ]
+                if not batch:
+                    break
+                for instance in pool.map(self.migrate_image, batch):
+                    if callback is not None:
+                        callback(instance)
+        finally:
+            pool.close()
+            pool.join()
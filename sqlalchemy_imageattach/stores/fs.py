@@ -16,9 +16,12 @@ It provides two filesystem-backed image storage implementations:
    based on the actual requested URL.
 
 """
+import email.utils
+import errno
 import mimetypes
 import os
 import os.path
+import re
 import shutil
 
 from ..store import Store
@@ -38,6 +41,10 @@ def guess_extension(mimetype):
     :rtype: :class:`str`
 
     """
+    try:
+        return _extensions[mimetype]
+    except KeyError:
+        pass
     if mimetype == 'image/jpeg':
         # mimetypes.guess_extension() had been returned '.jpe' for
         # 'image/jpeg' until Python 3.3, but Python 3.3 has been
@@ -47,9 +54,16 @@ def guess_extension(mimetype):
         suffix = '.jpe'
     else:
         suffix = mimetypes.guess_extension(mimetype)
+    _extensions[mimetype] = suffix
     return suffix
 
 
+# The memo of guess_extension(), since mimetypes.guess_extension() scans
+# the whole types map every time.  functools.lru_cache() isn't available
+# on Python 2.
+_extensions = {}
+
+
 class BaseFileSystemStore(Store):
     """Abstract base class of :class:`FileSystemStore` and
     :class:`HttpExposedFileSystemStore`.
@@ -60,23 +74,42 @@ class BaseFileSystemStore(Store):
         self.path = path
 
     def get_path(self, object_type, object_id, width, height, mimetype):
-        id_segment_a = str(object_id % 1000)
-        id_segment_b = str(object_id // 1000)
+        id_segment_b, id_segment_a = divmod(object_id, 1000)
         suffix = guess_extension(mimetype)
         filename = '{0}.{1}x{2}{3}'.format(object_id, width, height, suffix)
-        return object_type, id_segment_a, id_segment_b, filename
+        return object_type, str(id_segment_a), str(id_segment_b), filename
 
     def put_file(self, file, object_type, object_id, width, height, mimetype,
                  reproducible):
         path = self.get_path(object_type, object_id, width, height, mimetype)
-        for i in range(len(path)):
-            d = os.path.join(self.path, *path[:i])
-            if not os.path.isdir(d):
-                os.mkdir(d)
-        path_str = os.path.join(self.path, *path)
-        with open(path_str, 'wb') as dst:
+        self._make_dirs(path[:-1])
+        with open(os.path.join(self.path, *path), 'wb') as dst:
             shutil.copyfileobj(file, dst)
 
+    def _make_dirs(self, path):
+        """Makes the directory of the given ``path`` segments (relative
+        to :attr:`path`) and its parents if they don't exist yet.
+
+        :param path: directory names from the top to the bottom
+        :type path: :class:`~typing.Sequence`\ [:class:`str`]
+
+        """
+        dir_path = os.path.join(self.path, *path)
+        # Mostly only the leaf directory is missing, so try mkdir() first
+        # which doesn't stat() parent directories unlike os.makedirs().
+        try:
+            os.mkdir(dir_path)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                try:
+                    os.makedirs(dir_path)
+                except OSError as e:
+                    # os.makedirs() has no exist_ok parameter on Python 2.
+                    if e.errno != errno.EEXIST:
+                        raise
+            elif e.errno != errno.EEXIST:
+                raise
+
     def delete_file(self, *args, **kwargs):
         path = os.path.join(self.path, *self.get_path(*args, **kwargs))
         try:
@@ -171,17 +204,24 @@ HttpExposedFileSystemStore for more details
     :param cors: whether or not to allow the `Cross-Origin Resource Sharing`_
                  for any origin
     :type cors: :class:`bool`
+    :param max_age: the ``max-age`` seconds of :mailheader:`Cache-Control`
+                    for serving image files.  no :mailheader:`Cache-Control`
+                    by default
+    :type max_age: :class:`numbers.Integral`
 
     .. _Cross-Origin Resource Sharing: https://developer.mozilla.org/en-US/\
 docs/Web/HTTP/Access_control_CORS
 
+    .. versionadded:: 1.2.0
+       Added ``max_age`` option.
+
     .. versionadded:: 1.0.0
        Added ``host_url_getter`` option.
 
     """
 
     def __init__(self, path, prefix='__images__', host_url_getter=None,
-                 cors=False):
+                 cors=False, max_age=None):
         if not (callable(host_url_getter) or host_url_getter is None):
             raise TypeError('host_url_getter must be callable')
         super(HttpExposedFileSystemStore, self).__init__(path)
@@ -190,16 +230,26 @@ docs/Web/HTTP/Access_control_CORS
         if prefix.endswith('/'):
             prefix = prefix[:-1]
         self.prefix = prefix
+        # (host_url, prefix, base_url) of the last computed base_url
+        self._base_url_cache = None
         self.host_url_getter = host_url_getter
         self.cors = cors
+        self.max_age = max_age
 
     @property
     def base_url(self):
         if self.host_url_getter is not None:
             host_url = self.host_url_getter()
+            prefix = self.prefix
+            cache = self._base_url_cache
+            if cache is not None and cache[:2] == (host_url, prefix):
+                return cache[2]
             if host_url.endswith('/'):
-                return '{0}{1}/'.format(host_url, self.prefix)
-            return '{0}/{1}/'.format(host_url, self.prefix)
+                base_url = host_url + prefix + '/'
+            else:
+                base_url = host_url + '/' + prefix + '/'
+            self._base_url_cache = host_url, prefix, base_url
+            return base_url
         elif getattr(self, 'host_url', None):
             return self.host_url + self.prefix + '/'
         raise RuntimeError(
@@ -227,7 +277,7 @@ docs/Web/HTTP/Access_control_CORS
 
         """
         _app = StaticServerMiddleware(app, '/' + self.prefix, self.path,
-                                      cors=self.cors)
+                                      cors=self.cors, max_age=self.max_age)
 
         def app(environ, start_response):
             if not hasattr(self, 'host_url'):
@@ -258,64 +308,275 @@ class StaticServerMiddleware(object):
     :param cors: whether or not to allow the `Cross-Origin Resource Sharing`_
                  for any origin
     :type cors: :class:`bool`
+    :param max_age: the ``max-age`` seconds of :mailheader:`Cache-Control`.
+                    no :mailheader:`Cache-Control` by default
+    :type max_age: :class:`numbers.Integral`
+
+    It responds :mailheader:`ETag` and :mailheader:`Last-Modified`,
+    and ``304 Not Modified`` to conditional requests
+    (:mailheader:`If-None-Match` and :mailheader:`If-Modified-Since`).
+    It also responds ``206 Partial Content`` to single byte range requests
+    (:mailheader:`Range`).
+
+    .. versionadded:: 1.2.0
+       Added ``max_age`` option, and conditional requests and byte range
+       requests support.
 
     .. todo::
 
        - Security considerations (especially about paths)
-       - :mailheader:`ETag`
-       - :mailheader:`Last-Modified` and :mailheader:`If-Modified-Since`
-       - :mailheader:`Cache-Control` and :mailheader:`Expires`
 
     """
 
-    def __init__(self, app, url_path, dir_path, block_size=8192, cors=False):
+    def __init__(self, app, url_path, dir_path, block_size=8192, cors=False,
+                 max_age=None):
         if not url_path.startswith('/'):
             url_path = '/' + url_path
         if not url_path.endswith('/'):
             url_path += '/'
         if not dir_path:
-            dir_path = '.'
+            dir_path = './'
         elif not dir_path.endswith('/'):
             dir_path += '/'
         self.app = app
         self.url_path = url_path
         self.dir_path = dir_path
         self.block_size = int(block_size)
-        self.cors_enabled = cors
+        self._cors_enabled = cors
+        self._max_age = max_age
+        self._build_extra_headers()
+        # The memo of mimetypes by filename extensions.
+        self._mimetypes = {}
 
-    def file_stream(self, path):
-        with open(path, 'rb') as f:
-            while 1:
-                buf = f.read(self.block_size)
-                if buf:
+    @property
+    def cors_enabled(self):
+        """(:class:`bool`) Whether to respond the CORS header
+        :mailheader:`Access-Control-Allow-Origin`.
+
+        """
+        return self._cors_enabled
+
+    @cors_enabled.setter
+    def cors_enabled(self, cors_enabled):
+        self._cors_enabled = cors_enabled
+        self._build_extra_headers()
+
+    @property
+    def max_age(self):
+        """(:class:`numbers.Integral`) The ``max-age`` seconds of
+        :mailheader:`Cache-Control`.  :const:`None` if it's not responded.
+
+        """
+        return self._max_age
+
+    @max_age.setter
+    def max_age(self, max_age):
+        self._max_age = max_age
+        self._build_extra_headers()
+
+    def _build_extra_headers(self):
+        # Headers that don't vary by request are built only when
+        # the options change.
+        extra_headers = []
+        if self._max_age is not None:
+            extra_headers.append(('Cache-Control',
+                                  'public, max-age=' + str(self._max_age)))
+        if self._cors_enabled:
+            extra_headers.append(('Access-Control-Allow-Origin', '*'))
+        self._extra_headers = extra_headers
+
+    #: (:class:`re.RegexObject`) The pattern of :mailheader:`Range` header
+    #: values which can be handled.  Multiple ranges aren't supported.
+    RANGE_PATTERN = re.compile(r'^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$')
+
+    def file_stream(self, file, length=None):
+        """Iterates over the given ``file`` by :attr:`block_size` bytes,
+        and then closes it.  It's used only when the WSGI server doesn't
+        provide ``'wsgi.file_wrapper'`` or only a part of the file is
+        requested.
+
+        :param file: the opened file to stream
+        :type file: :class:`file`, file-like object
+        :param length: the number of bytes to stream from the current
+                       position.  until EOF if omitted
+        :type length: :class:`numbers.Integral`
+        :returns: the iterator of byte chunks
+        :rtype: :class:`~typing.Iterator`\ [:class:`bytes`]
+
+        """
+        read = file.read
+        block_size = self.block_size
+        with file:
+            if length is None:
+                while 1:
+                    buf = read(block_size)
+                    if not buf:
+                        break
                     yield buf
-                else:
-                    break
+            else:
+                while length > 0:
+                    buf = read(min(block_size, length))
+                    if not buf:
+                        break
+                    length -= len(buf)
+                    yield buf
+
+    def guess_type(self, path):
+        """Guesses the mimetype of the given ``path`` by its filename
+        extension.  Guessed mimetypes are memoized by extensions.
+
+        :param path: the path of the file to guess its mimetype
+        :type path: :class:`str`
+        :returns: the mimetype e.g. ``'image/jpeg'``.
+                  ``'application/octet-stream'`` if it's unknown
+        :rtype: :class:`str`
+
+        """
+        _, ext = os.path.splitext(path)
+        try:
+            return self._mimetypes[ext]
+        except KeyError:
+            pass
+        mimetype, encoding = mimetypes.guess_type(path)
+        mimetype = mimetype or 'application/octet-stream'
+        if encoding is None:
+            # Encoded files e.g. .tar.gz depend on more than one extension.
+            self._mimetypes[ext] = mimetype
+        return mimetype
+
+    def get_range(self, range_, size):
+        """Interprets the :mailheader:`Range` header value.
+
+        :param range_: the :mailheader:`Range` header value
+                       e.g. ``'bytes=0-499'``
+        :type range_: :class:`str`
+        :param size: the size of the whole file
+        :type size: :class:`numbers.Integral`
+        :returns: the pair of the first and the last byte positions
+                  (both inclusive).  :const:`None` if the header is absent
+                  or can't be handled, which means the whole file should
+                  be responded
+        :rtype: :class:`~typing.Tuple`\ [:class:`numbers.Integral`,
+                                          :class:`numbers.Integral`]
+        :raise ValueError: when the range is not satisfiable
+
+        """
+        match = self.RANGE_PATTERN.match(range_ or '')
+        if not match:
+            return None
+        first, last = match.groups()
+        if first:
+            first = int(first)
+            if not last:
+                last = size - 1
+            elif int(last) < first:
+                return None  # syntactically invalid; ignore the header
+            else:
+                last = int(last)
+        elif last:
+            first = max(size - int(last), 0)
+            last = size - 1
+        else:
+            return None
+        if first >= size or last < first:
+            raise ValueError('range not satisfiable: ' + repr(range_))
+        return first, min(last, size - 1)
+
+    def is_not_modified(self, environ, etag, mtime):
+        """Determines whether the conditional request can be responded
+        with ``304 Not Modified``.  :mailheader:`If-None-Match` takes
+        precedence over :mailheader:`If-Modified-Since` if both are present.
+
+        :param environ: the wsgi environment of the request
+        :type environ: :class:`~typing.Mapping`\ [:class:`str`,
+                                                   :class:`object`]
+        :param etag: the current :mailheader:`ETag` of the file
+        :type etag: :class:`str`
+        :param mtime: the last modification time of the file in seconds
+                      since the epoch
+        :type mtime: :class:`numbers.Real`
+        :returns: :const:`True` if the client's copy is still fresh
+        :rtype: :class:`bool`
+
+        """
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            tags = set(tag.strip() for tag in if_none_match.split(','))
+            return bool(tags & set(['*', etag, 'W/' + etag]))
+        if_modified_since = environ.get('HTTP_IF_MODIFIED_SINCE')
+        if if_modified_since:
+            parsed = email.utils.parsedate_tz(if_modified_since)
+            if parsed is not None:
+                return int(mtime) <= email.utils.mktime_tz(parsed)
+        return False
 
     def __call__(self, environ, start_response):
         path = environ.get('PATH_INFO', '/')
         if not path.startswith(self.url_path):
             return self.app(environ, start_response)
-        file_path = os.path.join(self.dir_path, path[len(self.url_path):])
+        # Both are normalized: dir_path ends with a slash and url_path
+        # as well, so simple concatenation works.  Unlike os.path.join()
+        # it doesn't let an absolute remainder replace dir_path, and
+        # parent directory segments are refused, so that the file path
+        # can't escape dir_path.
+        rest = path[len(self.url_path):]
+        file_path = self.dir_path + rest
         try:
-            stat = os.stat(file_path)
+            if '..' in rest.split('/'):
+                raise IOError(errno.ENOENT, 'path escapes the directory')
+            file = open(file_path, 'rb')
         except (IOError, OSError):
             start_response('404 Not Found', [('Content-Type', 'text/plain')])
             return '404 Not Found',
-        mimetype, _ = mimetypes.guess_type(file_path)
-        mimetype = mimetype or 'application/octet-stream'
-        headers = [
-            ('Content-Type', mimetype),
-            ('Content-Length', str(stat.st_size))
-        ]
-        if self.cors_enabled:
-            headers.append(('Access-Control-Allow-Origin', '*'))
-        start_response('200 OK', headers)
-        try:
-            file_wrapper = environ['wsgi.file_wrapper']
-        except KeyError:
-            pass
+        stat = os.fstat(file.fileno())
+        etag = '"{0:x}-{1:x}"'.format(int(stat.st_mtime * 1000000),
+                                      stat.st_size)
+        last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+        headers = [('ETag', etag), ('Last-Modified', last_modified)]
+        headers.extend(self._extra_headers)
+        if self.is_not_modified(environ, etag, stat.st_mtime):
+            file.close()
+            start_response('304 Not Modified', headers)
+            return ()
+        if_range = environ.get('HTTP_IF_RANGE')
+        if if_range and if_range.strip() not in (etag, last_modified):
+            range_ = None
         else:
-            if callable(file_wrapper):
-                return file_wrapper(open(file_path, 'rb'), self.block_size)
-        return self.file_stream(file_path)
+            try:
+                range_ = self.get_range(environ.get('HTTP_RANGE'),
+                                        stat.st_size)
+            except ValueError:
+                file.close()
+                start_response('416 Range Not Satisfiable', [
+                    ('Content-Type', 'text/plain'),
+                    ('Content-Range', 'bytes */{0}'.format(stat.st_size))
+                ])
+                return b'416 Range Not Satisfiable',
+        headers.append(('Content-Type', self.guess_type(file_path)))
+        headers.append(('Accept-Ranges', 'bytes'))
+        if hasattr(os, 'posix_fadvise'):  # Python 3.3+ on POSIX
+            # Since the file is read sequentially, let the kernel read ahead
+            # more aggressively.  It's merely a hint, so errors are ignored.
+            try:
+                os.posix_fadvise(file.fileno(), 0, 0,
+                                 os.POSIX_FADV_SEQUENTIAL)
+            except OSError:
+                pass
+        if range_ is not None:
+            first, last = range_
+            length = last - first + 1
+            headers.append(('Content-Range', 'bytes {0}-{1}/{2}'.format(
+                first, last, stat.st_size
+            )))
+            headers.append(('Content-Length', str(length)))
+            start_response('206 Partial Content', headers)
+            file.seek(first)
+            return self.file_stream(file, length)
+        headers.append(('Content-Length', str(stat.st_size)))
+        start_response('200 OK', headers)
+        # Prefer the server's file wrapper since it can send the file using
+        # platform-specific zero-copy mechanisms e.g. sendfile(2).
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if callable(file_wrapper):
+            return file_wrapper(file, self.block_size)
+        return self.file_stream(file)
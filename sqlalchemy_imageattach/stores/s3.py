@@ -9,13 +9,21 @@ provided by `Amazon Web Services <AWS>`_.
 
 """
 import base64
-import calendar
+import binascii
+import collections
 import datetime
-import email.utils
 import hashlib
 import hmac
+try:
+    from http import client as httplib
+except ImportError:
+    import httplib
 import io
 import logging
+import multiprocessing.pool
+import socket
+import threading
+import time
 try:
     from urllib import parse as urlparse
 except ImportError:
@@ -46,49 +54,169 @@ BASE_URL_FORMAT = 'https://{0}.s3.amazonaws.com'
 
 BASE_REGION_URL_FORMAT = 'https://{0}.s3.{region}.amazonaws.com'
 
+# The hex digest of SHA-256 of an empty body, which is the most common
+# payload (GET, HEAD and DELETE requests).
+_EMPTY_SHA256 = hashlib.sha256(b'').hexdigest()
+
+# The size of chunks in bytes to read when a request body is a file.
+_CHUNK_SIZE = 64 * 1024
+
+try:
+    _hmac_digest = hmac.digest  # Python 3.7+; one-shot in C
+except AttributeError:
+    def _hmac_digest(key, message, digest):
+        return hmac.new(key, message, getattr(hashlib, digest)).digest()
+
+
+def _make_uri_encoding_table(safe):
+    return tuple(chr(byte) if chr(byte) in safe else '%{0:02X}'.format(byte)
+                 for byte in range(256))
+
+
+# The tables to look up the percent-encoded form of each byte, that
+# S3RequestV4.uri_encode() uses.  Unreserved characters are left as they are.
+_URI_UNRESERVED = frozenset(
+    'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_-~.'
+)
+_URI_ENCODING_TABLE = _make_uri_encoding_table(_URI_UNRESERVED)
+_URI_ENCODING_TABLE_KEEP_SLASH = _make_uri_encoding_table(
+    _URI_UNRESERVED | frozenset('/')
+)
+
+
+# Weekday and month names for HTTP dates.  These don't depend on the locale
+# unlike strftime()'s %a and %b.
+_WEEKDAYS = 'Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+           'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def _format_http_date(timestamp):
+    """Formats the given UTC ``timestamp`` in the same way to
+    :func:`email.utils.formatdate()` with ``usegmt=True`` does,
+    e.g. ``'Tue, 10 Oct 2017 12:34:56 GMT'``.
+
+    :param timestamp: the naive datetime in UTC
+    :type timestamp: :class:`datetime.datetime`
+    :returns: the formatted http date
+    :rtype: :class:`str`
+
+    """
+    return '%s, %02d %s %04d %02d:%02d:%02d GMT' % (
+        _WEEKDAYS[timestamp.weekday()], timestamp.day,
+        _MONTHS[timestamp.month - 1], timestamp.year,
+        timestamp.hour, timestamp.minute, timestamp.second
+    )
+
+
+def _digest_body(data, hash_):
+    """Updates the given ``hash_`` with the request body ``data`` and returns
+    the ``hash_``.  If ``data`` is a file it's read by :const:`_CHUNK_SIZE`
+    bytes, and then rewound to the original position.
+
+    :param data: the request body
+    :type data: :class:`bytes`, seekable file-like object
+    :param hash_: the hash object to update e.g. :func:`hashlib.sha256()`
+    :returns: the given ``hash_``
+
+    """
+    if data is None:
+        return hash_
+    elif isinstance(data, bytes):
+        hash_.update(data)
+        return hash_
+    offset = data.tell()
+    while 1:
+        chunk = data.read(_CHUNK_SIZE)
+        if not chunk:
+            break
+        hash_.update(chunk)
+    data.seek(offset)
+    return hash_
+
+
+def _get_body_length(data):
+    """Gets the length of the request body ``data`` in bytes.  If ``data``
+    is a file, it's the length from the current position to the end.
+
+    :param data: the request body
+    :type data: :class:`bytes`, seekable file-like object
+    :returns: the length in bytes
+    :rtype: :class:`numbers.Integral`
+
+    """
+    if isinstance(data, bytes):
+        return len(data)
+    offset = data.tell()
+    data.seek(0, io.SEEK_END)
+    length = data.tell() - offset
+    data.seek(offset)
+    return length
+
 
 class S3RequestV4(urllib2.Request):
     """HTTP request for S3 REST API which does authentication using
     `Signature Version 4`__ (AWS4Auth).
 
+    :param signing_key_cache: an optional mapping to share derived
+                              signing keys between requests.  since
+                              a signing key changes only once a day,
+                              requests made by the same store can reuse it
+    :type signing_key_cache: :class:`~typing.MutableMapping`
+    :param content_sha256: the precomputed hex digest of SHA-256 of
+                           ``data``, if it's already known
+    :type content_sha256: :class:`str`
+
     .. versionadded:: 1.1.0
 
+    .. versionadded:: 1.2.0
+       The ``signing_key_cache`` and ``content_sha256`` parameters.
+
     __ \
 https://docs.aws.amazon.com/AmazonS3/latest/API/sig-v4-authenticating-requests.html
 
     """
 
     logger = logging.getLogger(__name__ + '.S3RequestV4')
+    _signature_logger = logger.getChild('get_signature')
+    _string_to_sign_logger = logger.getChild('get_string_to_sign')
 
     def __init__(self, url, bucket, region, access_key, secret_key,
-                 data=None, headers={}, method=None, content_type=None):
+                 data=None, headers={}, method=None, content_type=None,
+                 signing_key_cache=None, content_sha256=None):
         urllib2.Request.__init__(self, url, data=data, headers=headers)
         self.bucket = bucket
         self.region = region.strip().lower()
         self.access_key = access_key
         self.secret_key = secret_key
         self.method = method
+        self.signing_key_cache = signing_key_cache
         if self.data is None:
             self.content_type = ''
         else:
             assert content_type
             self.add_header('Content-type', content_type)
             self.content_type = content_type
-            self.add_header('Content-length', str(len(self.data)))
-        self.content_sha256 = hashlib.sha256(self.data or b'') \
-                                     .hexdigest().lower()
+            self.add_header('Content-length',
+                            str(_get_body_length(self.data)))
+        if self.data is None:
+            self.content_sha256 = _EMPTY_SHA256
+        elif content_sha256 is None:
+            self.content_sha256 = _digest_body(self.data, hashlib.sha256()) \
+                .hexdigest().lower()
+        else:
+            self.content_sha256 = content_sha256.lower()
         self.add_header('x-amz-content-sha256', self.content_sha256)
         self.add_header('Host', self.host or urlparse.urlparse(url).netloc)
         self.timestamp = datetime.datetime.utcnow()
-        self.date = email.utils.formatdate(
-            calendar.timegm(self.timestamp.timetuple()),
-            usegmt=True
-        )
+        self.date_stamp = self.timestamp.strftime('%Y%m%d')
+        self.date = _format_http_date(self.timestamp)
         self.add_header('Date', self.date)
         authorization = self.get_authorization()
         self.logger.debug('get_authorization() = %r', authorization)
         self.add_header('Authorization', authorization)
-        self.logger.debug('header_items() = %r', self.header_items())
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('header_items() = %r', self.header_items())
 
     def get_method(self):
         return self.method or urllib2.Request.get_method(self) or 'GET'
@@ -110,7 +238,7 @@ https://docs.aws.amazon.com/AmazonS3/latest/API/sig-v4-authenticating-requests.h
 
     def get_credential(self):
         yield self.access_key
-        yield self.timestamp.strftime('%Y%m%d')
+        yield self.date_stamp
         yield self.region
         yield 's3'
         yield 'aws4_request'
@@ -118,15 +246,23 @@ https://docs.aws.amazon.com/AmazonS3/latest/API/sig-v4-authenticating-requests.h
     def get_signature(self):
         signing_key = self.get_signing_key()
         string_to_sign, signed_headers = self.get_string_to_sign()
-        self.logger.getChild('get_signature').debug('string_to_sign = %r',
-                                                    string_to_sign)
-        digest = hmac.new(signing_key, string_to_sign, hashlib.sha256)
-        return digest.hexdigest().lower(), signed_headers
+        logger = self._signature_logger
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('string_to_sign = %r', string_to_sign)
+        digest = _hmac_digest(signing_key, string_to_sign, 'sha256')
+        return binascii.hexlify(digest).decode('ascii'), signed_headers
 
     def get_signing_key(self):
+        cache = self.signing_key_cache
+        if cache is not None:
+            cache_key = self.secret_key, self.date_stamp, self.region
+            try:
+                return cache[cache_key]
+            except KeyError:
+                pass
         date_key = self.hmac_sha256(
             b'AWS4' + self.secret_key.encode('ascii'),
-            self.timestamp.strftime('%Y%m%d').encode('ascii')
+            self.date_stamp.encode('ascii')
         )
         date_region_key = self.hmac_sha256(
             date_key,
@@ -135,27 +271,34 @@ https://docs.aws.amazon.com/AmazonS3/latest/API/sig-v4-authenticating-requests.h
         date_region_service_key = self.hmac_sha256(date_region_key, b's3')
         signing_key = self.hmac_sha256(date_region_service_key,
                                        b'aws4_request')
+        if cache is not None:
+            cache.clear()  # keys of the past days are no more used
+            cache[cache_key] = signing_key
         return signing_key
 
     def get_string_to_sign(self):
         canonical_request_chunks, signed_headers = self.get_canonical_request()
-
-        def generate():
-            yield b'AWS4-HMAC-SHA256\n'
-            yield self.date.encode('ascii')
-            yield b'\n'
-            yield self.timestamp.strftime('%Y%m%d/').encode('ascii')
-            yield self.region.encode('ascii')
-            yield b'/s3/aws4_request'
-            yield b'\n'
+        logger = self._string_to_sign_logger
+        canonical_request_digest = hashlib.sha256()
+        if logger.isEnabledFor(logging.DEBUG):
             canonical_request = b''.join(canonical_request_chunks)
-            self.logger.getChild('get_string_to_sign').debug(
-                'canonical_request = %r',
-                canonical_request
-            )
-            canonical_request_digest = hashlib.sha256(canonical_request)
-            yield canonical_request_digest.hexdigest().lower().encode('ascii')
-        return b''.join(generate()), signed_headers
+            logger.debug('canonical_request = %r', canonical_request)
+            canonical_request_digest.update(canonical_request)
+        else:
+            # Feed chunks directly without joining them into a buffer
+            for chunk in canonical_request_chunks:
+                canonical_request_digest.update(chunk)
+        string_to_sign = b''.join([
+            b'AWS4-HMAC-SHA256\n',
+            self.date.encode('ascii'),
+            b'\n',
+            self.date_stamp.encode('ascii'),
+            b'/',
+            self.region.encode('ascii'),
+            b'/s3/aws4_request\n',
+            canonical_request_digest.hexdigest().lower().encode('ascii'),
+        ])
+        return string_to_sign, signed_headers
 
     def get_canonical_request(self):
         canonical_headers, signed_headers = self.get_canonical_headers()
@@ -179,55 +322,35 @@ https://docs.aws.amazon.com/AmazonS3/latest/API/sig-v4-authenticating-requests.h
         return generate(), signed_headers
 
     def make_canonical_query_string(self, query_string):
-        parsed = urlparse.parse_qs(query_string, keep_blank_values=True)
+        if query_string.startswith('?'):
+            query_string = query_string[1:]
+        parsed = urlparse.parse_qsl(query_string, keep_blank_values=True)
         urienc = self.uri_encode
-        items = [(urienc(k), urienc(v)) for k, v in parsed.items()]
-        items.sort(key=lambda pair: pair[0])
-        first = True
-        for k, v in items:
-            if first:
-                first = False
-            else:
-                yield '&'
-            yield k
-            yield '='
-            yield v
+        items = sorted((urienc(k), urienc(v)) for k, v in parsed)
+        yield '&'.join([k + '=' + v for k, v in items])
 
     def get_canonical_headers(self):
         headers = {k.lower(): v.strip() for k, v in self.header_items()}
         assert headers.get('host')
         assert headers.get('x-amz-content-sha256')
-        pairs = sorted(headers.items(), key=lambda pair: pair[0])
-        line = '{0}:{1}\n'.format
-        canonical_headers = ''.join(line(k, v) for k, v in pairs)
-        signed_headers = ';'.join(k for k, _ in pairs)
+        pairs = sorted(headers.items())  # keys are unique
+        canonical_headers = ''.join([k + ':' + v + '\n' for k, v in pairs])
+        signed_headers = ';'.join([k for k, _ in pairs])
         return canonical_headers, signed_headers
 
     @staticmethod
     def uri_encode(string, encode_slash=True):
-        to_hex = '%{0:02X}'.format
-        is_byte_int = type(b'.'[0]) is int
-
-        def to_hex_utf8(char):
-            for b in char.encode('utf-8'):
-                yield to_hex(b if is_byte_int else ord(b))
-
-        def encode(string, encode_slash):
-            for c in string:
-                if 'A' <= c <= 'Z' or 'a' <= c <= 'z' or '0' <= c <= '9' or \
-                   c in '_-~.':
-                    yield c
-                elif c == '/':
-                    yield '%2F' if encode_slash else c
-                else:
-                    for byte_repr in to_hex(ord(c)):
-                        yield byte_repr
-
-        return ''.join(encode(string, encode_slash))
+        if not isinstance(string, bytes):
+            string = string.encode('utf-8')
+        if encode_slash:
+            table = _URI_ENCODING_TABLE
+        else:
+            table = _URI_ENCODING_TABLE_KEEP_SLASH
+        return ''.join([table[byte] for byte in bytearray(string)])
 
     @staticmethod
     def hmac_sha256(key, message):
-        return hmac.new(key, message, hashlib.sha256).digest()
+        return _hmac_digest(key, message, 'sha256')
 
 
 class S3RequestV2(urllib2.Request):
@@ -235,11 +358,18 @@ class S3RequestV2(urllib2.Request):
     `Signature Version 2`__ (AWS2Auth) which has been deprecated since
     January 30, 2014.
 
+    :param content_md5: the precomputed base64-encoded MD5 digest of
+                        ``data``, if it's already known
+    :type content_md5: :class:`str`
+
     .. versionadded:: 1.1.0
 
     .. versionchanged:: 1.1.0
        Renamed from :class:`S3Request` (which is now deprecated).
 
+    .. versionadded:: 1.2.0
+       The ``content_md5`` parameter.
+
     __ https://docs.aws.amazon.com/AmazonS3/latest/dev/RESTAuthentication.html
 
     """
@@ -247,7 +377,10 @@ class S3RequestV2(urllib2.Request):
     logger = logging.getLogger(__name__ + '.S3RequestV2')
 
     def __init__(self, url, bucket, access_key, secret_key,
-                 data=None, headers={}, method=None, content_type=None):
+                 data=None, headers={}, method=None, content_type=None,
+                 content_md5=None):
+        # x-amz-* headers by their lowercased names; see add_header()
+        self._amz_headers = {}
         urllib2.Request.__init__(self, url, data=data, headers=headers)
         self.bucket = bucket
         self.access_key = access_key
@@ -258,17 +391,17 @@ class S3RequestV2(urllib2.Request):
             self.content_type = ''
         else:
             assert content_type
-            self.content_md5 = base64.b64encode(
-                hashlib.md5(self.data).digest()
-            ).decode('ascii')
+            if content_md5 is None:
+                content_md5 = base64.b64encode(
+                    _digest_body(self.data, hashlib.md5()).digest()
+                ).decode('ascii')
+            self.content_md5 = content_md5
             self.content_type = content_type
             self.add_header('Content-md5', self.content_md5)
             self.add_header('Content-type', content_type)
-            self.add_header('Content-length', len(self.data))
-        self.date = email.utils.formatdate(
-            calendar.timegm(datetime.datetime.utcnow().timetuple()),
-            usegmt=True
-        )
+            self.add_header('Content-length',
+                            str(_get_body_length(self.data)))
+        self.date = _format_http_date(datetime.datetime.utcnow())
         self.add_header('Date', self.date)
         authorization = self.get_authorization()
         self.logger.debug('get_authorization() = %r', authorization)
@@ -282,37 +415,38 @@ class S3RequestV2(urllib2.Request):
         return url[url.index('/', 8):]
 
     def get_authorization(self):
-        return 'AWS {0}:{1}'.format(
-            self.access_key,
-            self.get_signature().decode('utf-8')
-        )
+        return ('AWS ' + self.access_key + ':' +
+                self.get_signature().decode('utf-8'))
 
     def get_signature(self):
         sign = self.sign()
         self.logger.debug('sign() = %r', sign)
-        d = hmac.new(
+        digest = _hmac_digest(
             self.secret_key.encode('utf-8'),
             sign.encode('utf-8'),
-            hashlib.sha1
+            'sha1'
         )
-        return base64.b64encode(d.digest())
+        return base64.b64encode(digest)
 
     def sign(self):
-        return '\n'.join([
+        return '{0}\n{1}\n{2}\n{3}\n{4}{5}'.format(
             self.get_method().upper(),
             self.content_md5,
             self.content_type,
             self.date,
-            self.canonicalize_headers() + self.canonicalize_resource()
-        ])
+            self.canonicalize_headers(),
+            self.canonicalize_resource()
+        )
+
+    def add_header(self, key, val):
+        urllib2.Request.add_header(self, key, val)
+        lower_key = key.lower()
+        if lower_key.startswith('x-amz-'):
+            self._amz_headers[lower_key] = val
 
     def canonicalize_headers(self):
-        pairs = [(k.lower(), v)
-                 for k, v in self.header_items()
-                 if k.lower().startswith('x-amz-')]
-        pairs.sort(key=lambda pair: pair[0])
-        line = '{0}:{1}\n'.format
-        return ''.join(line(k, v) for k, v in pairs)
+        pairs = sorted(self._amz_headers.items())
+        return ''.join([k + ':' + v + '\n' for k, v in pairs])
 
     def canonicalize_resource(self):
         # FIXME: query should be lexicographically sorted if multiple
@@ -330,6 +464,120 @@ class S3Request(S3RequestV2):
     """
 
 
+class _ConnectionPool(object):
+    """Keeps idle HTTP connections per host to reuse them for subsequent
+    requests, so that each request doesn't pay a new TCP connection
+    and TLS handshake.  It's thread-safe.
+
+    :param maxsize: the maximum number of idle connections to keep
+                    per host
+    :type maxsize: :class:`numbers.Integral`
+    :param timeout: the seconds to wait for blocking socket operations
+    :type timeout: :class:`numbers.Real`
+    :param max_idle_time: the seconds to keep an idle connection.
+                          servers and middleboxes tend to silently drop
+                          connections idle for a while
+    :type max_idle_time: :class:`numbers.Real`
+
+    """
+
+    def __init__(self, maxsize=16, timeout=60, max_idle_time=15):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.max_idle_time = max_idle_time
+        self.lock = threading.Lock()
+        # (scheme, netloc) -> [(connection, released_at)]
+        self.idle_connections = {}
+
+    def acquire(self, scheme, netloc, reuse=True):
+        expired = []
+        try:
+            if reuse:
+                stale_before = time.time() - self.max_idle_time
+                with self.lock:
+                    idle = self.idle_connections.get((scheme, netloc), [])
+                    while idle:
+                        connection, released_at = idle.pop()
+                        if released_at > stale_before:
+                            return connection, True
+                        expired.append(connection)
+        finally:
+            for connection in expired:
+                connection.close()
+        if scheme == 'https':
+            connection = httplib.HTTPSConnection(netloc, timeout=self.timeout)
+        else:
+            connection = httplib.HTTPConnection(netloc, timeout=self.timeout)
+        return connection, False
+
+    def release(self, scheme, netloc, connection):
+        with self.lock:
+            idle = self.idle_connections.setdefault((scheme, netloc), [])
+            if len(idle) < self.maxsize:
+                idle.append((connection, time.time()))
+                return
+        connection.close()
+
+    def discard(self, scheme, netloc):
+        with self.lock:
+            idle = self.idle_connections.pop((scheme, netloc), [])
+        for connection, _ in idle:
+            connection.close()
+
+    def read(self, request):
+        """Sends the given ``request`` and reads the whole response body.
+        If a reused idle connection turns out to be closed by the server,
+        the other idle connections to the same host are likely to be
+        closed as well.  They are all discarded, and the request is
+        retried once on a new connection.
+
+        :param request: the request to send
+        :type request: :class:`urllib2.Request`
+        :returns: the response body
+        :rtype: :class:`bytes`
+        :raise urllib2.HTTPError: when the response status is not 2xx
+        :raise urllib2.URLError: when it fails to send the request or
+                                 to read the response
+
+        """
+        url = request.get_full_url()
+        scheme, netloc, path, query, _ = urlparse.urlsplit(url)
+        if query:
+            path += '?' + query
+        method = request.get_method()
+        body = request.data
+        offset = None if body is None or isinstance(body, bytes) \
+            else body.tell()
+        headers = dict(request.header_items())
+        reuse = True
+        while 1:
+            connection, reused = self.acquire(scheme, netloc, reuse)
+            try:
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                content = response.read()
+            except (httplib.HTTPException, socket.error) as e:
+                connection.close()
+                if reused:
+                    # The idle connection might have been closed by
+                    # the server; retry with a new connection.
+                    self.discard(scheme, netloc)
+                    if offset is not None:
+                        body.seek(offset)
+                    reuse = False
+                    continue
+                raise urllib2.URLError(e)
+            break
+        if response.will_close:
+            connection.close()
+        else:
+            self.release(scheme, netloc, connection)
+        if not 200 <= response.status < 300:
+            raise urllib2.HTTPError(url, response.status, response.reason,
+                                    response.msg, io.BytesIO(content))
+        return content
+
+
 class S3Store(Store):
     """Image storage backend implementation using S3_.  It implements
     :class:`~sqlalchemy_imageattach.store.Store` interface.
@@ -430,6 +678,26 @@ https://docs.aws.amazon.com/AmazonS3/latest/API/sig-v4-authenticating-requests.h
     #: .. versionadded:: 1.1.0
     max_retry = None
 
+    #: (:class:`numbers.Real`) The seconds to wait before the first retrial
+    #: of a failed upload.  It doubles for each subsequent retrial, but
+    #: doesn't exceed :attr:`max_retry_delay`.
+    #:
+    #: .. versionadded:: 1.2.0
+    retry_delay = 0.1
+
+    #: (:class:`numbers.Real`) The maximum seconds to wait before
+    #: a retrial.
+    #:
+    #: .. versionadded:: 1.2.0
+    max_retry_delay = 30
+
+    #: (:class:`bool`) Whether to reuse persistent connections to upload
+    #: and delete files.  See also :meth:`urlread()`.  :const:`False`
+    #: by default.
+    #:
+    #: .. versionadded:: 1.2.0
+    persistent_connections = False
+
     def __init__(self, bucket, access_key=None, secret_key=None,
                  max_age=DEFAULT_MAX_AGE, prefix='', public_base_url=None,
                  region=None, max_retry=5):
@@ -445,16 +713,15 @@ https://docs.aws.amazon.com/AmazonS3/latest/API/sig-v4-authenticating-requests.h
                 region=region
             )
         self.max_age = max_age
-        self.prefix = prefix.strip()
-        if self.prefix.endswith('/'):
-            self.prefix = self.prefix.rstrip('/')
+        self.prefix = prefix.strip().rstrip('/')
         if public_base_url is None:
             self.public_base_url = self.base_url
-        elif public_base_url.endswith('/'):
-            self.public_base_url = public_base_url.rstrip('/')
         else:
-            self.public_base_url = public_base_url
+            self.public_base_url = public_base_url.rstrip('/')
         self.max_retry = max_retry
+        # Signature Version 4 signing keys derived for the current day.
+        self._signing_keys = {}
+        self._connection_pool = _ConnectionPool()
 
     def get_key(self, object_type, object_id, width, height, mimetype):
         key = '{0}/{1}/{2}x{3}{4}'.format(
@@ -462,7 +729,7 @@ https://docs.aws.amazon.com/AmazonS3/latest/API/sig-v4-authenticating-requests.h
             guess_extension(mimetype)
         )
         if self.prefix:
-            return '{0}/{1}'.format(self.prefix, key)
+            return self.prefix + '/' + key
         return key
 
     def get_file(self, *args, **kwargs):
@@ -471,16 +738,10 @@ https://docs.aws.amazon.com/AmazonS3/latest/API/sig-v4-authenticating-requests.h
         return self.urlopen(request)
 
     def get_s3_url(self, *args, **kwargs):
-        return '{0}/{1}'.format(
-            self.base_url,
-            self.get_key(*args, **kwargs)
-        )
+        return self.base_url + '/' + self.get_key(*args, **kwargs)
 
     def get_url(self, *args, **kwargs):
-        return '{0}/{1}'.format(
-            self.public_base_url,
-            self.get_key(*args, **kwargs)
-        )
+        return self.public_base_url + '/' + self.get_key(*args, **kwargs)
 
     def make_request(self, url, *args, **kwargs):
         if self.region is None:
@@ -489,6 +750,7 @@ https://docs.aws.amazon.com/AmazonS3/latest/API/sig-v4-authenticating-requests.h
             cls = S3RequestV4
             kwargs = dict(kwargs)
             kwargs['region'] = self.region
+            kwargs['signing_key_cache'] = self._signing_keys
         return cls(
             url, *args,
             bucket=self.bucket,
@@ -501,36 +763,96 @@ https://docs.aws.amazon.com/AmazonS3/latest/API/sig-v4-authenticating-requests.h
         try:
             return urllib2.urlopen(*args, **kwargs)
         except urllib2.HTTPError as e:
-            if e.code == 400 and \
-               e.headers.get('content-type') == 'application/xml':
-                xml_body = e.read()
-                if b'please use aws4-hmac-sha256.' in xml_body.lower():
-                    e.close()
-                    raise AuthMechanismError(
-                        e.filename, e.code, e.msg, e.hdrs,
-                        io.BytesIO(xml_body)
-                    )
+            self._raise_auth_mechanism_error(e)
             raise
 
+    def urlread(self, request):
+        """Sends the given ``request`` and reads the whole response body.
+        If :attr:`persistent_connections` is :const:`True` and no proxy
+        is configured, it reuses persistent connections unlike
+        :meth:`urlopen()`.
+
+        Note that requests sent through persistent connections bypass
+        the opener installed by :func:`urllib2.install_opener()
+        <urllib.request.install_opener>`, e.g. custom handlers for
+        proxies or SSL contexts.  To debug them, set
+        :attr:`httplib.HTTPConnection.debuglevel
+        <http.client.HTTPConnection.debuglevel>` instead.
+
+        :param request: the request to send
+        :type request: :class:`urllib2.Request`
+        :returns: the response body
+        :rtype: :class:`bytes`
+
+        .. versionadded:: 1.2.0
+
+        """
+        if not self.persistent_connections or urllib2.getproxies():
+            response = self.urlopen(request)
+            try:
+                return response.read()
+            finally:
+                response.close()
+        try:
+            return self._connection_pool.read(request)
+        except urllib2.HTTPError as e:
+            self._raise_auth_mechanism_error(e)
+            raise
+
+    def _raise_auth_mechanism_error(self, e):
+        if e.code == 400 and \
+           e.headers.get('content-type') == 'application/xml':
+            xml_body = e.read()
+            if b'please use aws4-hmac-sha256.' in xml_body.lower():
+                e.close()
+                raise AuthMechanismError(
+                    e.filename, e.code, e.msg, e.hdrs,
+                    io.BytesIO(xml_body)
+                )
+
     def upload_file(self, url, data, content_type, rrs, acl='public-read'):
+        """Uploads the given ``data`` to the ``url``.  It retries at the most
+        :attr:`max_retry` times if it fails.
+
+        :param url: the s3 url to upload to
+        :type url: :class:`str`
+        :param data: the data to upload.  if it's a file, it has to be
+                     seekable, and is uploaded from the current position
+                     to the end without buffering the whole in memory
+        :type data: :class:`bytes`, seekable file-like object
+        :param content_type: the mimetype of the ``data``
+        :type content_type: :class:`str`
+        :param rrs: whether to use :const:`REDUCED_REDUNDANCY` storage
+                    class
+        :type rrs: :class:`bool`
+        :param acl: the canned acl.  ``'public-read'`` by default
+        :type acl: :class:`str`
+
+        """
+        offset = None if isinstance(data, bytes) else data.tell()
         headers = {
             'Cache-Control': 'max-age=' + str(self.max_age),
             'x-amz-acl': acl,
             'x-amz-storage-class': 'REDUCED_REDUNDANCY' if rrs else 'STANDARD'
         }
-        make_request = lambda url: self.make_request(  # noqa: E731
-            url,
-            method='PUT',
-            data=data,
-            content_type=content_type,
-            headers=headers
-        )
+
+        def make_request(url, **digest):
+            return self.make_request(
+                url,
+                method='PUT',
+                data=data,
+                content_type=content_type,
+                headers=headers,
+                **digest
+            )
         request = make_request(url)
         trial = 0
         while 1:
             trial += 1
+            if offset is not None:
+                data.seek(offset)  # rewind for the retrial
             try:
-                self.urlopen(request).read()
+                self.urlread(request)
             except urllib2.HTTPError as e:
                 if trial < self.max_retry and e.code == 307 and \
                    e.headers.get('content-type') == 'application/xml':
@@ -548,7 +870,16 @@ https://docs.aws.amazon.com/AmazonS3/latest/API/sig-v4-authenticating-requests.h
                     base_url = 'https://' + endpoint.text
                     assert url.startswith(self.base_url)
                     url = base_url + url[len(self.base_url):]
-                    request = make_request(url)
+                    # Reuse the digest of the body instead of reading and
+                    # hashing the whole body again.
+                    if isinstance(request, S3RequestV4):
+                        request = make_request(
+                            url, content_sha256=request.content_sha256
+                        )
+                    else:
+                        request = make_request(
+                            url, content_md5=request.content_md5
+                        )
                     self.base_url = base_url
                     continue
                 elif trial >= self.max_retry or 400 <= e.code < 500:
@@ -556,24 +887,133 @@ https://docs.aws.amazon.com/AmazonS3/latest/API/sig-v4-authenticating-requests.h
                     self.logger.debug(e.read())
                     raise
                 self.logger.debug(e)
+                self.wait_for_retry(trial)
                 continue
             except IOError as e:
                 if trial >= self.max_retry:
                     raise
                 self.logger.debug(e)
+                self.wait_for_retry(trial)
                 continue
             else:
                 break
 
+    def wait_for_retry(self, trial):
+        """Sleeps before retrying a failed upload, so that retrials don't
+        hammer S3 while it's throttling or partially unavailable.
+        The delay grows exponentially from :attr:`retry_delay`.
+
+        :param trial: the number of trials so far
+        :type trial: :class:`numbers.Integral`
+
+        .. versionadded:: 1.2.0
+
+        """
+        delay = min(self.retry_delay * 2 ** (trial - 1), self.max_retry_delay)
+        if delay > 0:
+            time.sleep(delay)
+
     def put_file(self, file, object_type, object_id, width, height, mimetype,
                  reproducible):
         url = self.get_s3_url(object_type, object_id, width, height, mimetype)
-        self.upload_file(url, file.read(), mimetype, rrs=reproducible)
+        try:
+            file.seek(file.tell())
+        except (AttributeError, IOError, OSError, ValueError):
+            # The body has to be read twice (for signing and sending),
+            # so unseekable files are buffered in memory.
+            data = file.read()
+        else:
+            data = file
+        self.upload_file(url, data, mimetype, rrs=reproducible)
+
+    def put_files(self, files, max_workers=8):
+        """Puts multiple files at a time.  Since uploads are bound to
+        network I/O, they are done concurrently by at the most
+        ``max_workers`` threads.  It's useful to upload an original image
+        and its thumbnails together.
+
+        :param files: the iterable of argument tuples of :meth:`put_file()`,
+                      i.e. ``(file, object_type, object_id, width, height,
+                      mimetype, reproducible)``.  each file shouldn't be
+                      shared by other tuples
+        :type files: :class:`~typing.Iterable`\ [:class:`tuple`]
+        :param max_workers: the maximum number of concurrent uploads.
+                            8 by default
+        :type max_workers: :class:`numbers.Integral`
+
+        .. versionadded:: 1.2.0
+
+        """
+        files = list(files)
+        workers = min(max_workers, len(files))
+        if workers < 2:
+            for args in files:
+                self.put_file(*args)
+            return
+        pool = multiprocessing.pool.ThreadPool(workers)
+        try:
+            pool.map(lambda args: self.put_file(*args), files)
+        finally:
+            pool.close()
+            pool.join()
 
     def delete_file(self, *args, **kwargs):
         url = self.get_s3_url(*args, **kwargs)
         request = self.make_request(url, method='DELETE')
-        self.urlopen(request).read()
+        self.urlread(request)
+
+    def delete_files(self, files):
+        """Deletes multiple files at a time.  It sends a request per
+        1,000 files using the `multi-object delete`__ API instead of
+        a request per file.  It's useful to delete an original image and
+        its thumbnails together.
+
+        :param files: the iterable of argument tuples of
+                      :meth:`delete_file()`, i.e. ``(object_type,
+                      object_id, width, height, mimetype)``
+        :type files: :class:`~typing.Iterable`\ [:class:`tuple`]
+        :raise IOError: when any of the files fails to be deleted
+
+        .. versionadded:: 1.2.0
+
+        __ \
+https://docs.aws.amazon.com/AmazonS3/latest/API/multiobjectdeleteapi.html
+
+        """
+        keys = [self.get_key(*args) for args in files]
+        url = self.base_url + '/?delete'
+        for i in range(0, len(keys), 1000):  # at the most 1,000 keys a request
+            root = xml.etree.ElementTree.Element('Delete')
+            xml.etree.ElementTree.SubElement(root, 'Quiet').text = 'true'
+            for key in keys[i:i + 1000]:
+                obj = xml.etree.ElementTree.SubElement(root, 'Object')
+                xml.etree.ElementTree.SubElement(obj, 'Key').text = key
+            body = xml.etree.ElementTree.tostring(root, encoding='utf-8')
+            # The multi-object delete API requires Content-MD5 even for
+            # Signature Version 4.
+            content_md5 = base64.b64encode(hashlib.md5(body).digest())
+            request = self.make_request(
+                url,
+                method='POST',
+                data=body,
+                content_type='application/xml',
+                headers={'Content-MD5': content_md5.decode('ascii')}
+            )
+            # Since it's in the quiet mode, the result contains only errors.
+            result = xml.etree.ElementTree.fromstring(self.urlread(request))
+            errors = []
+            for error in result:
+                if not error.tag.endswith('Error'):
+                    continue
+                ns = error.tag[:-len('Error')]  # e.g. '{http://...}'
+                errors.append((error.findtext(ns + 'Key'),
+                               error.findtext(ns + 'Code'),
+                               error.findtext(ns + 'Message')))
+            if errors:
+                raise IOError(
+                    'failed to delete {0} file(s): '.format(len(errors)) +
+                    '; '.join('{0}: {1} {2}'.format(*e) for e in errors)
+                )
 
 
 class S3SandboxStore(Store):
@@ -645,6 +1085,20 @@ https://docs.aws.amazon.com/AmazonS3/latest/API/sig-v4-authenticating-requests.h
     #: modification.
     overriding = None
 
+    #: (:class:`numbers.Real`) The number of seconds to remember which
+    #: store has an image, so that :meth:`get_url()` doesn't send
+    #: a ``HEAD`` request for every call.  Images put into the
+    #: *overriding* bucket by others may take this long to be seen.
+    #:
+    #: .. versionadded:: 1.2.0
+    probe_cache_ttl = 60
+
+    #: (:class:`numbers.Integral`) The maximum number of images to remember
+    #: which store has them.  The oldest ones are forgotten first.
+    #:
+    #: .. versionadded:: 1.2.0
+    probe_cache_size = 10000
+
     def __init__(self, underlying, overriding,
                  access_key=None, secret_key=None, max_age=DEFAULT_MAX_AGE,
                  underlying_prefix='', overriding_prefix='',
@@ -660,6 +1114,10 @@ https://docs.aws.amazon.com/AmazonS3/latest/API/sig-v4-authenticating-requests.h
                                   max_age=max_age, prefix=overriding_prefix,
                                   region=overriding_region,
                                   max_retry=max_retry)
+        # Keys' stores found by HEAD probes or by writes through this
+        # sandbox, with expiry times.
+        self._probe_cache = collections.OrderedDict()
+        self._probe_cache_lock = threading.Lock()
 
     def get_file(self, *args, **kwargs):
         try:
@@ -670,21 +1128,57 @@ https://docs.aws.amazon.com/AmazonS3/latest/API/sig-v4-authenticating-requests.h
             raise IOError('deleted')
         return file_
 
-    def get_url(self, *args, **kwargs):
+    def get_url(self, object_type, object_id, width, height, mimetype):
+        args = object_type, object_id, width, height, mimetype
+        return self._probe(args).get_url(*args)
+
+    def _probe(self, args):
+        """Finds the store that has the image of the given key ``args``.
+        The result is cached for :attr:`probe_cache_ttl` seconds, unless
+        the probe fails with other than ``404 Not Found``.
+
+        """
+        cache = self._probe_cache
+        now = time.time()
+        with self._probe_cache_lock:
+            try:
+                store, expires_at = cache[args]
+            except KeyError:
+                pass
+            else:
+                if expires_at > now:
+                    return store
+                del cache[args]
+        store = self.overriding
         request = self.overriding.make_request(
-            self.overriding.get_url(*args, **kwargs),
+            self.overriding.get_url(*args),
             method='HEAD'
         )
-        store = self.overriding
         try:
-            urllib2.urlopen(request)
+            urllib2.urlopen(request).close()
         except urllib2.HTTPError as e:
-            if e.code == 404:
-                store = self.underlying
-        return store.get_url(*args, **kwargs)
+            if e.code != 404:
+                # It might be transient, so the next call probes again.
+                return store
+            store = self.underlying
+        self._cache_probe(args, store, now)
+        return store
+
+    def _cache_probe(self, args, store, now=None):
+        cache = self._probe_cache
+        if now is None:
+            now = time.time()
+        with self._probe_cache_lock:
+            cache.pop(args, None)  # to be the newest one
+            cache[args] = store, now + self.probe_cache_ttl
+            while len(cache) > self.probe_cache_size:
+                cache.popitem(last=False)
 
-    def put_file(self, *args, **kwargs):
-        self.overriding.put_file(*args, **kwargs)
+    def put_file(self, file, object_type, object_id, width, height, mimetype,
+                 reproducible):
+        args = object_type, object_id, width, height, mimetype
+        self.overriding.put_file(file, *(args + (reproducible,)))
+        self._mark_overridden(args)
 
     def delete_file(self, object_type, object_id, width, height, mimetype):
         args = object_type, object_id, width, height, mimetype
@@ -697,6 +1191,12 @@ https://docs.aws.amazon.com/AmazonS3/latest/API/sig-v4-authenticating-requests.h
             rrs=True,
             acl='private'
         )
+        self._mark_overridden(args)
+
+    def _mark_overridden(self, args):
+        # The key is certainly in the overriding store now (deleted ones
+        # have the deletion mark), so get_url() doesn't need to probe it.
+        self._cache_probe(args, self.overriding)
 
 
 class AuthMechanismError(urllib2.HTTPError):
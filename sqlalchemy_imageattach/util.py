@@ -6,7 +6,6 @@ docstrings at runtime.  It's useful for adjusting the docs
 built by Sphinx without making the code ugly.
 
 """
-import re
 import textwrap
 
 __all__ = ('append_docstring', 'append_docstring_attributes',
@@ -33,11 +32,16 @@ def get_minimum_indent(docstring, ignore_before=1):
     :rtype: :class:`str`
 
     """
-    indent_re = re.compile(r'^\s*')
-    indents = [indent_re.match(line).group(0)
-               for line in docstring.splitlines()[ignore_before:]
-               if line.strip()]
-    return min(indents, key=len) if indents else ''
+    minimum = None
+    for line in docstring.splitlines()[ignore_before:]:
+        stripped = line.lstrip()
+        if not stripped:
+            continue
+        indent_length = len(line) - len(stripped)
+        if minimum is None or indent_length < minimum:
+            minimum = indent_length
+            indent = line[:indent_length]
+    return '' if minimum is None else indent
 
 
 def append_docstring(docstring, *lines):
@@ -20,13 +20,8 @@ DEFAULT_DATABASE_URL = 'sqlite://'
 
 sample_images_dir = os.path.join(os.path.dirname(__file__), 'images')
 
-cmd_options_intiailized = False
-
 
 def pytest_addoption(parser):
-    global cmd_options_intiailized
-    if cmd_options_intiailized:
-        return
     env = os.environ.get
     parser.addoption('--database-url', type='string',
                      default=env('IMAGEATTACH_TEST_DATABASE_URL',
@@ -58,15 +53,14 @@ def pytest_addoption(parser):
                      default=env('IMAGEATTACH_TEST_S3_SANDBOX_REGION'),
                      help='Region code (e.g. us-east-1) of --s3-sandbox-name '
                           '[default: %default]')
-    cmd_options_intiailized = True
 
 
 Base = declarative_base()
 Session = sessionmaker()
 
 
-@fixture
-def fx_session(request):
+@fixture(scope='session')
+def fx_engine(request):
     try:
         database_url = request.config.getoption('--database-url')
     except ValueError:
@@ -86,21 +80,37 @@ def fx_session(request):
     metadata = Base.metadata
     metadata.drop_all(bind=engine)
     metadata.create_all(bind=engine)
-    session = Session(bind=engine, autocommit=True)
 
     @request.addfinalizer
-    def finalize_session():
-        session.rollback()
+    def finalize_engine():
         metadata.drop_all(bind=engine)
         engine.dispose()
+    return engine
+
+
+@fixture
+def fx_session(request, fx_engine):
+    session = Session(bind=fx_engine, autocommit=True)
+
+    @request.addfinalizer
+    def finalize_session():
+        session.rollback()
+        session.close()
+        # The schema is shared by all tests; only its rows are cleared.
+        with fx_engine.begin() as connection:
+            for table in reversed(Base.metadata.sorted_tables):
+                connection.execute(table.delete())
     return session
 
 
-@fixture(scope='function', params=[
+@fixture(scope='session', params=[
     ('iu.jpg', 'image/jpeg', 405, 640),
     ('grapefruit_final.svg', 'image/svg+xml', 450, 450),
     ('INNOVA-W3C.pdf', 'application/pdf', 842, 595),
 ])
 def fx_sample_image(request):
     filename, mimetype, w, h = request.param
-    return (os.path.join(sample_images_dir, filename), mimetype, (w, h))
+    path = os.path.join(sample_images_dir, filename)
+    with open(path, 'rb') as f:
+        blob = f.read()
+    return path, mimetype, (w, h), blob
@@ -10,7 +10,7 @@ try:
     import stackless
 except ImportError:
     stackless = None
-from pytest import mark, raises
+from pytest import mark, param, raises
 
 from sqlalchemy_imageattach.context import (ContextError, current_store,
                                             get_current_store,
@@ -69,126 +69,77 @@ def test_push_pop():
         get_current_store()
 
 
-def test_thread_context():
-    values = []
-    store_1 = Store()
-    store_2 = Store()
+def run_threads(context_1, context_2):
+    thread_2 = threading.Thread(target=context_2, args=(lambda: None,))
 
-    def context_1():
-        try:
-            s = get_current_store()
-        except ContextError:
-            values.append('error')
-        else:
-            values.append(s)
-        with store_context(store_1):
-            values.append(get_current_store())
-            thread_2.start()
-            thread_2.join()
-            values.append(get_current_store())
-        try:
-            s = get_current_store()
-        except ContextError:
-            values.append('error')
-        else:
-            values.append(s)
-
-    def context_2():
-        try:
-            s = get_current_store()
-        except ContextError:
-            values.append('error')
-        else:
-            values.append(s)
-        with store_context(store_2):
-            values.append(get_current_store())
-    thread_1 = threading.Thread(target=context_1)
-    thread_2 = threading.Thread(target=context_2)
+    def switch_to_2():
+        thread_2.start()
+        thread_2.join()
+    thread_1 = threading.Thread(target=context_1, args=(switch_to_2,))
     thread_1.start()
     thread_1.join()
-    assert values == ['error', store_1, 'error', store_2, store_1, 'error']
 
 
-@mark.skipif('greenlet is None')
-def test_greenlet_context():
-    values = []
-    store_1 = Store()
-    store_2 = Store()
+def run_greenlets(context_1, context_2):
+    greenlet_1 = greenlet.greenlet(
+        lambda: context_1(lambda: greenlet_2.switch())
+    )
+    greenlet_2 = greenlet.greenlet(
+        lambda: context_2(lambda: greenlet_1.switch())
+    )
+    greenlet_1.switch()
 
-    def context_1():
-        try:
-            s = get_current_store()
-        except ContextError:
-            values.append('error')
-        else:
-            values.append(s)
-        with store_context(store_1):
-            values.append(get_current_store())
-            greenlet_2.switch()
-            values.append(get_current_store())
-        try:
-            s = get_current_store()
-        except ContextError:
-            values.append('error')
-        else:
-            values.append(s)
 
-    def context_2():
-        try:
-            s = get_current_store()
-        except ContextError:
-            values.append('error')
-        else:
-            values.append(s)
-        with store_context(store_2):
-            values.append(get_current_store())
-            greenlet_1.switch()
-    greenlet_1 = greenlet.greenlet(context_1)
-    greenlet_2 = greenlet.greenlet(context_2)
-    greenlet_1.switch()
-    assert values == ['error', store_1, 'error', store_2, store_1, 'error']
+def run_tasklets(context_1, context_2):
+    channel = stackless.channel()
+    join_channel = stackless.channel()
+    task_2 = stackless.tasklet(context_2)
 
+    def switch_to_2():
+        task_2(lambda: channel.send(None))
+        channel.receive()
 
-@mark.skipif('stackless is None')
-def test_stackless_context():
+    def task_1():
+        context_1(switch_to_2)
+        join_channel.send(None)
+    stackless.tasklet(task_1)()
+    join_channel.receive()
+
+
+@mark.parametrize('run', [
+    run_threads,
+    param(run_greenlets,
+          marks=mark.skipif(greenlet is None,
+                            reason='greenlet is not installed')),
+    param(run_tasklets,
+          marks=mark.skipif(stackless is None,
+                            reason='stackless is not available')),
+])
+def test_concurrent_context(run):
     values = []
     store_1 = Store()
     store_2 = Store()
 
-    def context_1(channel, join_channel):
+    def append_current_store():
         try:
             s = get_current_store()
         except ContextError:
             values.append('error')
         else:
             values.append(s)
+
+    def context_1(switch_to_2):
+        append_current_store()
         with store_context(store_1):
             values.append(get_current_store())
-            task_2(channel)
-            channel.receive()
+            switch_to_2()
             values.append(get_current_store())
-        try:
-            s = get_current_store()
-        except ContextError:
-            values.append('error')
-        else:
-            values.append(s)
-        join_channel.send(None)
+        append_current_store()
 
-    def context_2(channel):
-        try:
-            s = get_current_store()
-        except ContextError:
-            values.append('error')
-        else:
-            values.append(s)
+    def context_2(switch_back):
+        append_current_store()
         with store_context(store_2):
             values.append(get_current_store())
-            channel.send(None)
-    task_1 = stackless.tasklet(context_1)
-    task_2 = stackless.tasklet(context_2)
-    channel = stackless.channel()
-    join_channel = stackless.channel()
-    task_1(channel, join_channel)
-    join_channel.receive()
+            switch_back()
+    run(context_1, context_2)
     assert values == ['error', store_1, 'error', store_2, store_1, 'error']
@@ -5,13 +5,16 @@ import io
 from sqlalchemy_imageattach.file import ReusableFileProxy
 
 
+data = b'abcde' * 100
+
+
 def test_reusable_file_proxy():
-    buffer_ = io.BytesIO(b'abcde' * 100)
+    buffer_ = io.BytesIO(data)
     buffer_.seek(20)
     with ReusableFileProxy(buffer_) as proxy:
         assert proxy.tell() == 0
-        assert proxy.read() == b'abcde' * 100
+        assert proxy.read() == data
         assert proxy.tell() == 500
     assert buffer_.tell() == 20
-    assert buffer_.read() == b'abcde' * 96
+    assert buffer_.read() == data[20:]
     buffer_.close()
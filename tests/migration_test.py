@@ -1,12 +1,15 @@
 import io
 import os.path
+import threading
 
 from pytest import fixture
+from sqlalchemy import event
 
 from .conftest import Base, sample_images_dir
 from .entity_test import Samething, Something, SomethingCover
 from sqlalchemy_imageattach.context import store_context
-from sqlalchemy_imageattach.migration import migrate, migrate_class
+from sqlalchemy_imageattach.migration import (MigrationPlan, migrate,
+                                              migrate_class)
 from sqlalchemy_imageattach.store import Store
 
 
@@ -99,3 +102,32 @@ def test_migrate_iter(fx_session, fx_source_store, fx_migration):
     for _ in plan:
         pass
     assert fx_source_store.files == dst.files
+
+
+def test_migrate_execute_workers(fx_session, fx_source_store, fx_migration):
+    dst = SourceStore()
+    plan = migrate(fx_session, Base, fx_source_store, dst)
+    migrated = []
+    plan.execute(migrated.append, workers=4)
+    assert fx_source_store.files == dst.files
+    assert len(migrated) == len(dst.files)
+
+
+def test_migrate_execute_workers_expired(fx_session, fx_source_store,
+                                         fx_migration):
+    dst = SourceStore()
+    plan = migrate(fx_session, Base, fx_source_store, dst)
+    images = list(plan.function())
+    fx_session.expire_all()
+    threads = set()
+
+    def record_thread(*args):
+        threads.add(threading.current_thread())
+    event.listen(fx_session.bind, 'before_cursor_execute', record_thread)
+    try:
+        MigrationPlan(lambda: images, plan.migrate_image).execute(workers=4)
+    finally:
+        event.remove(fx_session.bind, 'before_cursor_execute', record_thread)
+    # Expired attributes have to be loaded in the calling thread
+    assert threads == set([threading.current_thread()])
+    assert fx_source_store.files == dst.files
@@ -9,6 +9,9 @@ from .stores.conftest import ExampleImage, utcnow
 from sqlalchemy_imageattach.store import Store
 
 
+sample_image_path = os.path.join(sample_images_dir, 'iu.jpg')
+
+
 class EmptyStore(Store):
     """Store subclass that doesn't implement abstract methods."""
 
@@ -16,8 +19,7 @@ class EmptyStore(Store):
 @mark.parametrize('store_cls', [EmptyStore, Store])
 def miss_put_file(store_cls):
     store = store_cls()
-    image_path = os.path.join(sample_images_dir, 'iu.jpg')
-    with open(image_path, 'rb') as image_file:
+    with open(sample_image_path, 'rb') as image_file:
         with raises(NotImplementedError):
             store.put_file(image_file, 'testing', 1234, 405, 640,
                            'image/jpeg', True)
@@ -70,27 +72,24 @@ class FakeStore(Store):
     INCLUDE_QUERY_FOR_URL = 999999
 
     def __init__(self):
-        self.log = []
+        self.files = {}
 
     def put_file(self, file, object_type, object_id, width, height, mimetype,
                  reproducible):
-        self.log.append(
-            (file.read(), object_type, object_id, width, height,
-             mimetype, reproducible)
-        )
+        key = object_type, object_id, width, height, mimetype
+        self.files[key] = file.read(), reproducible
 
     def delete_file(self, object_type, object_id, width, height, mimetype):
-        self.log = [
-            log
-            for log in self.log
-            if log[1:6] != (object_type, object_id, width, height, mimetype)
-        ]
+        key = object_type, object_id, width, height, mimetype
+        self.files.pop(key, None)
 
     def get_file(self, object_type, object_id, width, height, mimetype):
-        for log in self.log:
-            if log[1:6] == (object_type, object_id, width, height, mimetype):
-                return io.BytesIO(log[0])
-        raise IOError()
+        key = object_type, object_id, width, height, mimetype
+        try:
+            data, _ = self.files[key]
+        except KeyError:
+            raise IOError()
+        return io.BytesIO(data)
 
     def get_url(self, object_type, object_id, width, height, mimetype):
         hash_ = hash((object_type, object_id, width, height, mimetype))
@@ -102,21 +101,19 @@ class FakeStore(Store):
 
 def test_store():
     store = FakeStore()
-    image_path = os.path.join(sample_images_dir, 'iu.jpg')
-    with open(image_path, 'rb') as image_file:
+    with open(sample_image_path, 'rb') as image_file:
         image = ExampleImage(thing_id=1234, width=405, height=640,
                              mimetype='image/jpeg', original=True,
                              created_at=utcnow())
         store.store(image, image_file)
         image_file.seek(0)
-        assert (image_file.read(), 'testing', 1234, 405, 640, 'image/jpeg',
-                False) in store.log
+        key = 'testing', 1234, 405, 640, 'image/jpeg'
+        assert store.files[key] == (image_file.read(), False)
 
 
 def test_store_typeerror():
     store = FakeStore()
-    image_path = os.path.join(sample_images_dir, 'iu.jpg')
-    with open(image_path, 'rb') as image_file:
+    with open(sample_image_path, 'rb') as image_file:
         with raises(TypeError):
             store.store(123, image_file)
         with raises(TypeError):
@@ -136,15 +133,14 @@ def test_store_typeerror():
 
 def test_delete():
     store = FakeStore()
-    image_path = os.path.join(sample_images_dir, 'iu.jpg')
-    with open(image_path, 'rb') as image_file:
+    with open(sample_image_path, 'rb') as image_file:
         image = ExampleImage(thing_id=1234, width=405, height=640,
                              mimetype='image/jpeg', original=True,
                              created_at=utcnow())
         store.store(image, image_file)
-        assert len(store.log) == 1
+        assert len(store.files) == 1
         store.delete(image)
-    assert not store.log
+    assert not store.files
 
 
 def test_delete_typeerror():
@@ -159,11 +155,10 @@ def test_delete_typeerror():
 
 def test_open():
     store = FakeStore()
-    image_path = os.path.join(sample_images_dir, 'iu.jpg')
     image = ExampleImage(thing_id=1234, width=405, height=640,
                          mimetype='image/jpeg', original=True,
                          created_at=utcnow())
-    with open(image_path, 'rb') as image_file:
+    with open(sample_image_path, 'rb') as image_file:
         store.store(image, image_file)
         image_file.seek(0)
         with store.open(image) as f:
@@ -172,11 +167,10 @@ def test_open():
 
 def test_open_seek():
     store = FakeStore()
-    image_path = os.path.join(sample_images_dir, 'iu.jpg')
     image = ExampleImage(thing_id=1234, width=405, height=640,
                          mimetype='image/jpeg', original=True,
                          created_at=utcnow())
-    with open(image_path, 'rb') as image_file:
+    with open(sample_image_path, 'rb') as image_file:
         store.store(image, image_file)
         image_file.seek(0)
         with store.open(image, use_seek=True) as f:
@@ -20,8 +20,11 @@ class UTC(datetime.tzinfo):
         return datetime.timedelta(0)
 
 
+utc = UTC()
+
+
 def utcnow():
-    return datetime.datetime.utcnow().replace(tzinfo=UTC())
+    return datetime.datetime.now(utc)
 
 
 class ExampleImage(Base, Image):
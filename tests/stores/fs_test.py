@@ -1,7 +1,6 @@
-import functools
 import os
 import os.path
-import re
+import wsgiref.util
 
 from pytest import mark, raises
 from webob import Request
@@ -14,13 +13,19 @@ from sqlalchemy_imageattach.stores.fs import (FileSystemStore,
                                               guess_extension)
 
 
+def remove_query(url):
+    return url.partition('?')[0]
+
+
+sample_image_path = os.path.join(sample_images_dir, 'iu.jpg')
+
+
 def test_fs_store(tmpdir):
     fs_store = FileSystemStore(tmpdir.strpath, 'http://mock/img/')
     image = ExampleImage(thing_id=1234, width=405, height=640,
                          mimetype='image/jpeg', original=True,
                          created_at=utcnow())
-    image_path = os.path.join(sample_images_dir, 'iu.jpg')
-    with open(image_path, 'rb') as image_file:
+    with open(sample_image_path, 'rb') as image_file:
         expected_data = image_file.read()
         image_file.seek(0)
         fs_store.store(image, image_file)
@@ -29,14 +34,33 @@ def test_fs_store(tmpdir):
     assert expected_data == actual_data
     expected_url = 'http://mock/img/testing/234/1/1234.405x640.jpe'
     actual_url = fs_store.locate(image)
-    assert expected_url == re.sub(r'\?.*$', '', actual_url)
+    assert expected_url == remove_query(actual_url)
     fs_store.delete(image)
     with raises(IOError):
         fs_store.open(image)
     tmpdir.remove()
 
 
-remove_query = functools.partial(re.compile(r'\?.*$').sub, '')
+def test_fs_store_directories_removed(tmpdir):
+    """Even if directories are removed after they were made,
+    storing images should work well.
+
+    """
+    fs_store = FileSystemStore(tmpdir.strpath, 'http://mock/img/')
+    image = ExampleImage(thing_id=1234, width=405, height=640,
+                         mimetype='image/jpeg', original=True,
+                         created_at=utcnow())
+    with open(sample_image_path, 'rb') as image_file:
+        fs_store.store(image, image_file)
+    tmpdir.join('testing').remove()
+    with open(sample_image_path, 'rb') as image_file:
+        expected_data = image_file.read()
+        image_file.seek(0)
+        fs_store.store(image, image_file)
+    with fs_store.open(image) as actual:
+        actual_data = actual.read()
+    assert expected_data == actual_data
+    tmpdir.remove()
 
 
 def test_http_fs_store(tmpdir, **kwargs):
@@ -44,8 +68,7 @@ def test_http_fs_store(tmpdir, **kwargs):
     image = ExampleImage(thing_id=1234, width=405, height=640,
                          mimetype='image/jpeg', original=True,
                          created_at=utcnow())
-    image_path = os.path.join(sample_images_dir, 'iu.jpg')
-    with open(image_path, 'rb') as image_file:
+    with open(sample_image_path, 'rb') as image_file:
         expected_data = image_file.read()
         image_file.seek(0)
         http_fs_store.store(image, image_file)
@@ -97,8 +120,23 @@ def test_http_fs_store_host_url_getter(tmpdir):
     tmpdir.remove()
 
 
+def test_http_fs_store_base_url(tmpdir):
+    http_fs_store = HttpExposedFileSystemStore(tmpdir.strpath, 'images')
+    http_fs_store.host_url = 'http://localhost/'
+    assert http_fs_store.base_url == 'http://localhost/images/'
+    hosts = iter(['http://a.example.com', 'http://b.example.com/'])
+    http_fs_store.host_url_getter = lambda: next(hosts)
+    assert http_fs_store.base_url == 'http://a.example.com/images/'
+    assert http_fs_store.base_url == 'http://b.example.com/images/'
+    http_fs_store.host_url_getter = lambda: 'http://c.example.com/'
+    assert http_fs_store.base_url == 'http://c.example.com/images/'
+    http_fs_store.prefix = 'pictures'
+    assert http_fs_store.base_url == 'http://c.example.com/pictures/'
+
+
+@mark.parametrize('file_wrapper', [None, wsgiref.util.FileWrapper])
 @mark.parametrize('block_size', [None, 8192, 1024, 1024 * 1024])
-def test_static_server(block_size):
+def test_static_server(block_size, file_wrapper):
     def fallback_app(environ, start_response):
         start_response(
             '200 OK',
@@ -112,8 +150,11 @@ def test_static_server(block_size):
                                      block_size)
     else:
         app = StaticServerMiddleware(fallback_app, '/static/', test_dir)
+    environ = {}
+    if file_wrapper:
+        environ['wsgi.file_wrapper'] = file_wrapper
     # 200 OK
-    request = Request.blank('/static/context_test.py')
+    request = Request.blank('/static/context_test.py', environ)
     response = request.get_response(app)
     assert response.status_code == 200
     assert response.content_type == 'text/x-python'
@@ -121,7 +162,7 @@ def test_static_server(block_size):
         assert response.body == f.read()
         assert response.content_length == f.tell()
     # 200 OK: subdirectory
-    request = Request.blank('/static/stores/fs_test.py')
+    request = Request.blank('/static/stores/fs_test.py', environ)
     response = request.get_response(app)
     assert response.status_code == 200
     assert response.content_type == 'text/x-python'
@@ -132,13 +173,140 @@ def test_static_server(block_size):
     request = Request.blank('/static/not-exist')
     response = request.get_response(app)
     assert response.status_code == 404
+    # 404 Not Found: directory
+    request = Request.blank('/static/stores')
+    response = request.get_response(app)
+    assert response.status_code == 404
+    # 404 Not Found: paths escaping the directory
+    for path in '/static/../setup.py', '/static/stores/../../setup.py':
+        request = Request.blank(path)
+        response = request.get_response(app)
+        assert response.status_code == 404
+    request = Request.blank('/static/stores/../context_test.py')
+    response = request.get_response(app)
+    assert response.status_code == 404
     # fallback app
     request = Request.blank('/static-not/')
     response = request.get_response(app)
     assert response.text == 'fallback: /static-not/'
 
 
+def test_static_server_conditional_request():
+    def fallback_app(environ, start_response):
+        start_response('404 Not Found', [('Content-Type', 'text/plain')])
+        yield b'fallback'
+    test_dir = os.path.join(os.path.dirname(__file__), '..')
+    app = StaticServerMiddleware(fallback_app, '/static/', test_dir,
+                                 max_age=3600)
+    request = Request.blank('/static/context_test.py')
+    response = request.get_response(app)
+    assert response.status_code == 200
+    assert response.cache_control.max_age == 3600
+    etag = response.headers['ETag']
+    last_modified = response.headers['Last-Modified']
+    # If-None-Match
+    request = Request.blank('/static/context_test.py',
+                            headers={'If-None-Match': etag})
+    response = request.get_response(app)
+    assert response.status_code == 304
+    assert response.body == b''
+    assert response.headers['ETag'] == etag
+    request = Request.blank('/static/context_test.py',
+                            headers={'If-None-Match': '"other-etag"',
+                                     'If-Modified-Since': last_modified})
+    response = request.get_response(app)
+    assert response.status_code == 200
+    # If-Modified-Since
+    request = Request.blank('/static/context_test.py',
+                            headers={'If-Modified-Since': last_modified})
+    response = request.get_response(app)
+    assert response.status_code == 304
+    request = Request.blank(
+        '/static/context_test.py',
+        headers={'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT'}
+    )
+    response = request.get_response(app)
+    assert response.status_code == 200
+
+
+def test_static_server_options_changed():
+    test_dir = os.path.join(os.path.dirname(__file__), '..')
+    app = StaticServerMiddleware(None, '/static/', test_dir)
+    request = Request.blank('/static/context_test.py')
+    response = request.get_response(app)
+    assert response.cache_control.max_age is None
+    assert 'Access-Control-Allow-Origin' not in response.headers
+    app.max_age = 3600
+    app.cors_enabled = True
+    response = request.get_response(app)
+    assert response.cache_control.max_age == 3600
+    assert response.headers['Access-Control-Allow-Origin'] == '*'
+    app.max_age = None
+    app.cors_enabled = False
+    response = request.get_response(app)
+    assert response.cache_control.max_age is None
+    assert 'Access-Control-Allow-Origin' not in response.headers
+
+
+@mark.parametrize('block_size', [7, 8192])
+def test_static_server_range_request(block_size):
+    def fallback_app(environ, start_response):
+        start_response('404 Not Found', [('Content-Type', 'text/plain')])
+        yield b'fallback'
+    test_dir = os.path.join(os.path.dirname(__file__), '..')
+    app = StaticServerMiddleware(fallback_app, '/static/', test_dir,
+                                 block_size)
+    with open(os.path.join(test_dir, 'context_test.py'), 'rb') as f:
+        expected_data = f.read()
+    size = len(expected_data)
+
+    def get(range_, **headers):
+        headers['Range'] = range_
+        request = Request.blank('/static/context_test.py', headers=headers)
+        return request.get_response(app)
+    response = get('bytes=0-99')
+    assert response.status_code == 206
+    assert response.body == expected_data[:100]
+    assert response.content_length == 100
+    assert response.headers['Content-Range'] == 'bytes 0-99/{0}'.format(size)
+    response = get('bytes=100-')
+    assert response.status_code == 206
+    assert response.body == expected_data[100:]
+    response = get('bytes=-50')
+    assert response.status_code == 206
+    assert response.body == expected_data[-50:]
+    response = get('bytes=10-{0}'.format(size * 2))
+    assert response.status_code == 206
+    assert response.body == expected_data[10:]
+    # 416 Range Not Satisfiable
+    response = get('bytes={0}-'.format(size))
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == 'bytes */{0}'.format(size)
+    # Unsupported ranges are ignored
+    for range_ in 'bytes=5-3', 'bytes=0-1,5-6', 'items=0-1':
+        response = get(range_)
+        assert response.status_code == 200
+        assert response.body == expected_data
+        assert response.headers['Accept-Ranges'] == 'bytes'
+    # If-Range
+    etag = get('bytes=0-9').headers['ETag']
+    assert get('bytes=0-9', **{'If-Range': etag}).status_code == 206
+    response = get('bytes=0-9', **{'If-Range': '"other-etag"'})
+    assert response.status_code == 200
+    assert response.body == expected_data
+
+
 def test_guess_extension():
     assert guess_extension('image/jpeg') == '.jpe'
     assert guess_extension('image/png') == '.png'
     assert guess_extension('image/gif') == '.gif'
+
+
+def test_static_server_guess_type():
+    app = StaticServerMiddleware(None, '/static/', '.')
+    for _ in range(2):  # the second time it's memoized
+        assert app.guess_type('a.png') == 'image/png'
+        assert app.guess_type('a.jpg') == 'image/jpeg'
+        assert app.guess_type('a') == 'application/octet-stream'
+        assert app.guess_type('a.tar.gz') == 'application/x-tar'
+        assert app.guess_type('a.gz') == 'application/octet-stream'
@@ -1,7 +1,20 @@
 import functools
+try:
+    from http import client as httplib
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    import httplib
+import io
 import itertools
+import os
 import os.path
-import re
+import socket
+try:
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from SocketServer import ThreadingMixIn
+import threading
 try:
     from urllib import request as urllib2
 except ImportError:
@@ -14,82 +27,226 @@ from ..conftest import sample_images_dir
 from .conftest import ExampleImage, utcnow
 from sqlalchemy_imageattach.stores import s3
 from sqlalchemy_imageattach.stores.s3 import (AuthMechanismError,
-                                              S3SandboxStore, S3Store)
+                                              S3RequestV2, S3RequestV4,
+                                              S3SandboxStore, S3Store,
+                                              _ConnectionPool)
 
 
-remove_query = functools.partial(re.compile(r'\?.*$').sub, '')
+def remove_query(url):
+    return url.partition('?')[0]
+
 
 # Don't use HTTPS for unit testing (to utilize fakes3)
 s3.BASE_URL_FORMAT = 'http://{0}.s3.amazonaws.com'
 
-# Set debuglevel=1 of urllib2 to debug
-handler = urllib2.HTTPHandler(debuglevel=1)
-urllib2.install_opener(urllib2.build_opener(handler))
+# Set IMAGEATTACH_HTTP_DEBUG to dump HTTP traffic to debug.  S3Store's
+# persistent connections bypass urllib2 openers, so both have to be set.
+if os.environ.get('IMAGEATTACH_HTTP_DEBUG'):
+    handler = urllib2.HTTPHandler(debuglevel=1)
+    urllib2.install_opener(urllib2.build_opener(handler))
+    httplib.HTTPConnection.debuglevel = 1
+
+
+@mark.parametrize(('request_cls', 'kwargs', 'hash_headers'), [
+    (S3RequestV2, {}, ['Content-md5']),
+    (S3RequestV4, {'region': 'us-east-2'}, ['X-amz-content-sha256']),
+])
+def test_s3_request_file_body(request_cls, kwargs, hash_headers):
+    """File bodies are signed the same as bytes bodies, without consuming
+    the file.
+
+    """
+    data = b'image data ' * 10000
+    file_ = io.BytesIO(b'skipped' + data)
+    file_.seek(7)
+    kwargs.update(bucket='bucket', access_key='access', secret_key='secret',
+                  method='PUT', content_type='image/jpeg')
+    url = 'http://bucket.s3.amazonaws.com/key'
+    bytes_request = request_cls(url, data=data, **kwargs)
+    file_request = request_cls(url, data=file_, **kwargs)
+    assert file_.tell() == 7
+    for header in hash_headers + ['Content-length']:
+        assert (file_request.get_header(header) ==
+                bytes_request.get_header(header))
+    assert file_request.get_header('Content-length') == str(len(data))
+
+
+def test_s3_request_v4_signing_key_cache():
+    kwargs = dict(bucket='bucket', region='us-east-2', access_key='access',
+                  secret_key='secret')
+    url = 'http://bucket.s3.amazonaws.com/key'
+    cache = {}
+    request = S3RequestV4(url, signing_key_cache=cache, **kwargs)
+    signing_key = S3RequestV4(url, **kwargs).get_signing_key()
+    assert list(cache.values()) == [signing_key]
+    cache[next(iter(cache))] = b'cached key'
+    assert request.get_signing_key() == b'cached key'
+
+
+@mark.parametrize(('string', 'encode_slash', 'expected'), [
+    ('AZaz09_-~.', True, 'AZaz09_-~.'),
+    ('a b/c+d=', True, 'a%20b%2Fc%2Bd%3D'),
+    ('a b/c+d=', False, 'a%20b/c%2Bd%3D'),
+    (u'\uc774\ubbf8\uc9c0', True, '%EC%9D%B4%EB%AF%B8%EC%A7%80'),
+    (b'\xec\x9d\xb4', True, '%EC%9D%B4'),
+])
+def test_s3_request_v4_uri_encode(string, encode_slash, expected):
+    assert S3RequestV4.uri_encode(string, encode_slash) == expected
+
+
+@mark.parametrize(('query_string', 'expected'), [
+    ('', ''),
+    ('?acl', 'acl='),
+    ('?b=2&a=1&a=0', 'a=0&a=1&b=2'),
+    ('?prefix=a%2Fb+c&max-keys=10', 'max-keys=10&prefix=a%2Fb%20c'),
+])
+def test_s3_request_v4_canonical_query_string(query_string, expected):
+    request = S3RequestV4('http://bucket.s3.amazonaws.com/' + query_string,
+                          bucket='bucket', region='us-east-2',
+                          access_key='access', secret_key='secret')
+    actual = ''.join(request.make_canonical_query_string(query_string))
+    assert actual == expected
+
+
+def test_s3_store_wait_for_retry(monkeypatch):
+    delays = []
+    monkeypatch.setattr(s3.time, 'sleep', delays.append)
+    store = S3Store('bucket')
+    store.retry_delay = 0.5
+    store.max_retry_delay = 3
+    for trial in range(1, 6):
+        store.wait_for_retry(trial)
+    assert delays == [0.5, 1, 2, 3, 3]
+    del delays[:]
+    store.retry_delay = 0
+    store.wait_for_retry(1)
+    assert delays == []
+
+
+class PoolTestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        missing = self.path == '/missing'
+        body = b'missing' if missing else b'ok'
+        self.send_response(404 if missing else 200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        # Silently drop the connection as if it has been idle for too long
+        self.close_connection = self.path == '/drop'
+
+    def log_message(self, *args):
+        pass
+
+
+class PoolTestServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+    connections = 0
+
+
+@fixture
+def pool_test_server(request):
+    server = PoolTestServer(('127.0.0.1', 0), PoolTestHandler)
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+    thread.daemon = True
+    thread.start()
+
+    @request.addfinalizer
+    def finalize_server():
+        server.shutdown()
+        server.server_close()
+    base_url = 'http://{0}:{1}'.format(*server.server_address)
+    return server, lambda path: urllib2.Request(base_url + path, b'data')
+
+
+def test_connection_pool_reuse(pool_test_server):
+    server, make_request = pool_test_server
+    pool = _ConnectionPool()
+    for _ in range(3):
+        assert pool.read(make_request('/key')) == b'ok'
+    assert server.connections == 1
+
+
+def test_connection_pool_stale_connection(pool_test_server):
+    server, make_request = pool_test_server
+    pool = _ConnectionPool()
+    assert pool.read(make_request('/drop')) == b'ok'
+    # The dropped connection is retried with a new connection
+    assert pool.read(make_request('/key')) == b'ok'
+    assert server.connections == 2
+    assert pool.read(make_request('/key')) == b'ok'
+    assert server.connections == 2
+
+
+def test_connection_pool_max_idle_time(pool_test_server):
+    server, make_request = pool_test_server
+    pool = _ConnectionPool(max_idle_time=0)
+    assert pool.read(make_request('/key')) == b'ok'
+    assert pool.read(make_request('/key')) == b'ok'
+    assert server.connections == 2
+
+
+def test_connection_pool_errors(pool_test_server):
+    server, make_request = pool_test_server
+    pool = _ConnectionPool()
+    with raises(urllib2.HTTPError) as exc_info:
+        pool.read(make_request('/missing'))
+    assert exc_info.value.code == 404
+    assert exc_info.value.read() == b'missing'
+    # Error responses don't spoil the connection
+    assert pool.read(make_request('/key')) == b'ok'
+    assert server.connections == 1
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    request = urllib2.Request('http://127.0.0.1:{0}/'.format(port), b'data')
+    with raises(urllib2.URLError) as exc_info:
+        pool.read(request)
+    assert not isinstance(exc_info.value, urllib2.HTTPError)
 
 
 @fixture
 def s3_store_getter(request):
-    try:
-        name = request.config.getoption('--s3-name')
-    except ValueError:
-        name = None
+    getoption = request.config.getoption
+    name = getoption('--s3-name')
     if name is None:
         skip('--s3-{name,access-key,secret-key} options (and IMAGEATTACH_TEST'
              '_S3_{NAME,ACCESS_KEY,SECRET_KEY} envvars) were not provided')
         return
-    try:
-        access_key = request.config.getoption('--s3-access-key')
-    except ValueError:
-        access_key = None
-    try:
-        secret_key = request.config.getoption('--s3-secret-key')
-    except ValueError:
-        secret_key = None
-    try:
-        region = request.config.getoption('--s3-region')
-    except ValueError:
-        region = None
     return functools.partial(S3Store, name,
-                             access_key=access_key,
-                             secret_key=secret_key,
-                             region=region)
+                             access_key=getoption('--s3-access-key'),
+                             secret_key=getoption('--s3-secret-key'),
+                             region=getoption('--s3-region'))
 
 
 @fixture
 def s3_sandbox_store_getter(request):
-    try:
-        name = request.config.getoption('--s3-name')
-        sandbox_name = request.config.getoption('--s3-sandbox-name')
-    except ValueError:
-        name = None
-    if name is None:
+    getoption = request.config.getoption
+    name = getoption('--s3-name')
+    sandbox_name = getoption('--s3-sandbox-name')
+    if name is None or sandbox_name is None:
         skip('--s3-{name,sandbox-name,access-key,secret-key} options '
              '(and POPTESTS_S3_{NAME,SANDBOX_NAME,ACCESS_KEY,SECRET_KEY} '
              'envvars) were not provided')
         return
-    try:
-        access_key = request.config.getoption('--s3-access-key')
-    except ValueError:
-        access_key = None
-    try:
-        secret_key = request.config.getoption('--s3-secret-key')
-    except ValueError:
-        secret_key = None
-    try:
-        underlying_region = request.config.getoption('--s3-region')
-    except ValueError:
-        underlying_region = None
-    try:
-        overriding_region = request.config.getoption('--s3-sandbox-region')
-    except ValueError:
-        overriding_region = None
-    return functools.partial(S3SandboxStore,
-                             underlying=name,
-                             overriding=sandbox_name,
-                             access_key=access_key,
-                             secret_key=secret_key,
-                             underlying_region=underlying_region,
-                             overriding_region=overriding_region)
+    return functools.partial(
+        S3SandboxStore,
+        underlying=name,
+        overriding=sandbox_name,
+        access_key=getoption('--s3-access-key'),
+        secret_key=getoption('--s3-secret-key'),
+        underlying_region=getoption('--s3-region'),
+        overriding_region=getoption('--s3-sandbox-region')
+    )
 
 
 @mark.parametrize(
@@ -142,6 +299,36 @@ def test_s3_store(prefix, public_base_url, s3_store_getter):
         s3.open(image)
 
 
+@mark.flaky(reruns=3)
+def test_s3_store_put_files(s3_store_getter):
+    s3 = s3_store_getter()
+    thing_id = uuid.uuid1().int
+    sizes = [(405, 640), (100, 158), (50, 79)]
+    s3.put_files(
+        (io.BytesIO(str(size).encode('ascii')), 'testing', thing_id) +
+        size + ('image/jpeg', False)
+        for size in sizes
+    )
+    for size in sizes:
+        key_args = ('testing', thing_id) + size + ('image/jpeg',)
+        assert s3.get_file(*key_args).read() == str(size).encode('ascii')
+        s3.delete_file(*key_args)
+
+
+@mark.flaky(reruns=3)
+def test_s3_store_delete_files(s3_store_getter):
+    s3 = s3_store_getter()
+    thing_id = uuid.uuid1().int
+    files = [('testing', thing_id, w, h, 'image/jpeg')
+             for w, h in [(405, 640), (100, 158), (50, 79)]]
+    for key_args in files:
+        s3.put_file(io.BytesIO(b'image'), *(key_args + (False,)))
+    s3.delete_files(files)
+    for key_args in files:
+        with raises(IOError):
+            s3.get_file(*key_args)
+
+
 @mark.parametrize(('underlying_prefix', 'overriding_prefix'), [
     ('under', 'over'),
     ('', '')
@@ -217,3 +404,38 @@ def test_s3_sandbox_store(underlying_prefix, overriding_prefix,
         with raises(IOError):
             no_prefix.open(image)
     under.delete(under_image)
+
+
+def test_s3_sandbox_store_probe_cache_size(monkeypatch):
+    s3 = S3SandboxStore('underlying', 'overriding')
+    s3.probe_cache_size = 3
+    monkeypatch.setattr(s3.overriding, 'put_file', lambda *args: None)
+    for object_id in range(10):
+        s3.put_file(io.BytesIO(b''), 'testing', object_id, 1, 1, 'image/png',
+                    False)
+    assert list(s3._probe_cache) == [
+        ('testing', object_id, 1, 1, 'image/png') for object_id in (7, 8, 9)
+    ]
+    # Written keys are resolved to the overriding store without probing
+    monkeypatch.setattr(urllib2, 'urlopen', None)
+    expected_url = s3.overriding.get_url('testing', 9, 1, 1, 'image/png')
+    assert s3.get_url('testing', 9, 1, 1, 'image/png') == expected_url
+
+
+def test_s3_sandbox_store_probe_error(monkeypatch):
+    s3 = S3SandboxStore('underlying', 'overriding',
+                        access_key='access', secret_key='secret')
+    codes = [503, 404]
+
+    def urlopen(request):
+        raise urllib2.HTTPError(request.get_full_url(), codes.pop(0),
+                                'Error', {}, io.BytesIO())
+    monkeypatch.setattr(urllib2, 'urlopen', urlopen)
+    args = 'testing', 1, 1, 1, 'image/png'
+    # Errors other than 404 Not Found might be transient; not cached
+    assert s3.get_url(*args) == s3.overriding.get_url(*args)
+    assert args not in s3._probe_cache
+    assert s3.get_url(*args) == s3.underlying.get_url(*args)
+    assert not codes
+    # 404 Not Found is cached
+    assert s3.get_url(*args) == s3.underlying.get_url(*args)
@@ -1,30 +1,26 @@
-import collections
-import numbers
-import os
+import runpy
 
 from sqlalchemy import __version__
+from sqlalchemy_imageattach import version
 from sqlalchemy_imageattach.version import (SQLA_COMPAT_VERSION,
                                             SQLA_COMPAT_VERSION_INFO,
                                             VERSION, VERSION_INFO)
 
 
 def test_version_info():
-    assert isinstance(VERSION_INFO, collections.Sequence)
+    assert isinstance(VERSION_INFO, tuple)
     assert len(VERSION_INFO) == 3
-    assert isinstance(VERSION_INFO[0], numbers.Integral)
-    assert isinstance(VERSION_INFO[1], numbers.Integral)
-    assert isinstance(VERSION_INFO[2], numbers.Integral)
+    assert isinstance(VERSION_INFO[0], int)
+    assert isinstance(VERSION_INFO[1], int)
+    assert isinstance(VERSION_INFO[2], int)
 
 
 def test_sqlalchemy_version():
-    def parse_int(s):
-        try:
-            return int(s)
-        except ValueError:
-            return -1
-    sqla_version_info = tuple(map(parse_int, __version__.split('.')[:3]))
+    sqla_version_info = tuple(int(part) if part.isdigit() else -1
+                              for part in __version__.split('.')[:3])
     assert sqla_version_info >= SQLA_COMPAT_VERSION_INFO
-    assert __version__.split('.')[:3] >= SQLA_COMPAT_VERSION.split('.')[:2]
+    compat_version_info = tuple(map(int, SQLA_COMPAT_VERSION.split('.')[:2]))
+    assert sqla_version_info[:2] >= compat_version_info
 
 
 def test_version():
@@ -32,7 +28,10 @@ def test_version():
     assert list(map(int, VERSION.split('.'))) == list(VERSION_INFO)
 
 
-def test_print():
-    with os.popen('python -m sqlalchemy_imageattach.version') as pipe:
-        printed_version = pipe.read().strip()
-        assert printed_version == VERSION
+def test_print(capsys):
+    path = version.__file__
+    if path.endswith(('.pyc', '.pyo')):
+        path = path[:-1]
+    runpy.run_path(path, run_name='__main__')
+    printed_version, _ = capsys.readouterr()
+    assert printed_version.strip() == VERSION